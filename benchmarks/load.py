@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+# Load generator for the daemon. Calls RoficationDbusObject.Notify directly and through a
+# private dbus-daemon, and runs concurrent RoficationClient workers against a RoficationServer
+# on a temporary socket, for every queue size requested. Prints one JSON object per
+# measurement so that runs of different versions can be compared line by line.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Iterator, List, Mapping, Sequence
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rofication import __version__  # noqa: E402
+from rofication._notification import Notification  # noqa: E402
+from rofication._queue import NotificationQueue  # noqa: E402
+
+APPLICATIONS = ('Thunderbird', 'Slack', 'Firefox', 'Signal', 'Evolution')
+SUMMARIES = ('New message', 'Download complete', 'Reminder', 'Build finished')
+PARTS = ('direct', 'bus', 'clients')
+COMMANDS = ('num', 'list', 'del')
+
+
+def percentile(samples: Sequence[float], fraction: float) -> float:
+    # nearest rank on sorted samples
+    return samples[min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))]
+
+
+def summarize(latencies: List[float], elapsed: float) -> Mapping[str, any]:
+    latencies.sort()
+    return {
+        'operations': len(latencies),
+        'seconds': elapsed,
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000 if latencies else None,
+        'p99_ms': percentile(latencies, 0.99) * 1000 if latencies else None,
+    }
+
+
+def make_queue(size: int) -> NotificationQueue:
+    notifications = []
+    for i in range(size):
+        notification = Notification()
+        notification.id = i + 1
+        notification.application = APPLICATIONS[i % len(APPLICATIONS)]
+        notification.icon = ''
+        notification.summary = SUMMARIES[i % len(SUMMARIES)]
+        notification.body = f'Body of notification number {i}'
+        notification.actions = ('default', 'Open')
+        notification.timestamp = 1700000000.0 + i
+        notifications.append(notification)
+    return NotificationQueue({n.id: n for n in notifications})
+
+
+def notify_args(i: int) -> tuple:
+    # app_name, replaces_id, app_icon, summary, body, actions, hints, expire_timeout
+    return (APPLICATIONS[i % len(APPLICATIONS)], 0, '', SUMMARIES[i % len(SUMMARIES)],
+            f'Generated notification {i}', ['default', 'Open'], {}, -1)
+
+
+def timed(calls: Iterator[Callable[[], any]]) -> Mapping[str, any]:
+    latencies = []
+    start = time.perf_counter()
+    for call in calls:
+        begin = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - begin)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+@contextmanager
+def private_bus() -> Iterator[str]:
+    # a session bus of our own, the desktop's notification daemon stays untouched
+    process = subprocess.Popen(('dbus-daemon', '--session', '--nofork', '--print-address'),
+                               stdout=subprocess.PIPE, universal_newlines=True)
+    try:
+        address = process.stdout.readline().strip()
+        os.environ['DBUS_SESSION_BUS_ADDRESS'] = address
+        yield address
+    finally:
+        process.terminate()
+        process.wait()
+
+
+@contextmanager
+def dbus_object(queue: NotificationQueue, main_loop: bool) -> Iterator[any]:
+    from gi.repository import GLib
+    from rofication._dbus import RoficationDbusObject
+
+    obj = RoficationDbusObject(queue)
+    loop = GLib.MainLoop() if main_loop else None
+    thread = None
+    if loop is not None:
+        thread = threading.Thread(target=loop.run)
+        thread.daemon = True
+        thread.start()
+    try:
+        yield obj
+    finally:
+        if loop is not None:
+            loop.quit()
+            thread.join()
+        # the next queue size registers a new object on the same path
+        obj.remove_from_connection()
+
+
+def bench_direct(size: int, operations: int) -> Mapping[str, any]:
+    # the method body only, without marshalling or the bus round trip
+    with dbus_object(make_queue(size), main_loop=False) as obj:
+        return timed(lambda i=i: obj.Notify(*notify_args(i)) for i in range(operations))
+
+
+def bench_bus(size: int, operations: int) -> Mapping[str, any]:
+    import dbus
+    from rofication._dbus import NOTIFICATIONS_DBUS_INTERFACE, NOTIFICATIONS_DBUS_OBJECT_PATH
+
+    with dbus_object(make_queue(size), main_loop=True):
+        # a connection of its own, like any application sending notifications
+        bus = dbus.SessionBus(private=True)
+        try:
+            proxy = bus.get_object(NOTIFICATIONS_DBUS_INTERFACE, NOTIFICATIONS_DBUS_OBJECT_PATH)
+            notify = proxy.get_dbus_method('Notify', NOTIFICATIONS_DBUS_INTERFACE)
+            return timed(lambda i=i: notify(*notify_args(i)) for i in range(operations))
+        finally:
+            bus.close()
+
+
+def bench_clients(size: int, workers: int, requests: int, server: str) -> Iterator[Mapping[str, any]]:
+    from rofication import RoficationClient, RoficationServer, AsyncRoficationServer
+
+    queue = make_queue(size)
+    server_class = AsyncRoficationServer if server == 'asyncio' else RoficationServer
+    latencies: Mapping[str, List[float]] = {command: [] for command in COMMANDS}
+    lock = threading.Lock()
+
+    def worker(index: int, client: RoficationClient) -> None:
+        samples = {command: [] for command in COMMANDS}
+        # every worker dismisses its own share of the queue
+        to_delete = iter(range(index + 1, size + 1, workers))
+        for i in range(requests):
+            command = COMMANDS[i % len(COMMANDS)]
+            begin = time.perf_counter()
+            if command == 'num':
+                tuple(client.count())
+            elif command == 'list':
+                client.list()
+            else:
+                nid = next(to_delete, None)
+                if nid is None:
+                    continue
+                client.delete(nid)
+            samples[command].append(time.perf_counter() - begin)
+        with lock:
+            for command, values in samples.items():
+                latencies[command].extend(values)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        address = os.path.join(tmp, 'rofication.sock')
+        with server_class(queue, address) as srv:
+            srv.start()
+            client = RoficationClient(unix_socket=address)
+            threads = [threading.Thread(target=worker, args=(i, client)) for i in range(workers)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            srv.shutdown()
+
+    yield {'command': 'all', **summarize([v for values in latencies.values() for v in values], elapsed)}
+    for command in COMMANDS:
+        yield {'command': command, **summarize(latencies[command], elapsed)}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='rofication daemon load benchmark')
+    parser.add_argument('--sizes', type=lambda value: [int(size) for size in value.split(',')],
+                        default=[10, 100, 1000, 10000, 100000], help='comma separated queue sizes')
+    parser.add_argument('--parts', type=lambda value: value.split(','), default=list(PARTS),
+                        help=f'comma separated subset of {",".join(PARTS)}')
+    parser.add_argument('--notifications', type=int, default=2000, help='Notify calls per queue size')
+    parser.add_argument('--workers', type=int, default=4, help='concurrent socket clients')
+    parser.add_argument('--requests', type=int, default=60, help='requests per client and queue size')
+    parser.add_argument('--server', choices=('threaded', 'asyncio'), default='threaded')
+    args = parser.parse_args()
+
+    unknown = set(args.parts) - set(PARTS)
+    if unknown:
+        parser.error(f'unknown parts: {", ".join(sorted(unknown))}')
+
+    def report(part: str, size: int, measurement: Mapping[str, any]) -> None:
+        print(json.dumps({'benchmark': 'load', 'version': __version__, 'part': part,
+                          'queue_size': size, **measurement}), flush=True)
+
+    bus_parts = [part for part in ('direct', 'bus') if part in args.parts]
+    with private_bus() if bus_parts else nullcontext():
+        for size in args.sizes:
+            if 'direct' in bus_parts:
+                report('direct', size, bench_direct(size, args.notifications))
+            if 'bus' in bus_parts:
+                report('bus', size, bench_bus(size, args.notifications))
+            if 'clients' in args.parts:
+                for measurement in bench_clients(size, args.workers, args.requests, args.server):
+                    report('clients', size, {'server': args.server, 'workers': args.workers, **measurement})
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
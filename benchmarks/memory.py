@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+# Measures the memory a NotificationQueue holds per notification. Notifications are decoded
+# from JSON like they are when loaded from disk, so repeated strings arrive as separate
+# objects the same way they do from D-Bus. Prints one JSON object.
+
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rofication._notification import Notification  # noqa: E402
+from rofication._queue import NotificationQueue  # noqa: E402
+
+APPLICATIONS = ('Thunderbird', 'Slack', 'notify-send', 'Firefox', 'Signal')
+SUMMARIES = ('New message', 'Download complete', 'Reminder', 'Build finished')
+
+
+def payload(count: int) -> str:
+    return json.dumps([{
+        'id': i + 1,
+        'application': APPLICATIONS[i % len(APPLICATIONS)],
+        'icon': f'{APPLICATIONS[i % len(APPLICATIONS)].lower()}-icon',
+        'summary': SUMMARIES[i % len(SUMMARIES)],
+        'body': f'Body of notification number {i}',
+        'urgency': i % 3,
+        'actions': ['default', 'Open'],
+        'hints': {},
+        'timestamp': 1700000000.0 + i,
+    } for i in range(count)])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='notification queue memory benchmark')
+    parser.add_argument('--notifications', type=int, default=10000)
+    args = parser.parse_args()
+
+    data = payload(args.notifications)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    queue = NotificationQueue({n.id: n for n in map(Notification.make, json.loads(data))})
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print(json.dumps({
+        'benchmark': 'memory',
+        'notifications': len(queue),
+        'total_bytes': after - before,
+        'bytes_per_notification': (after - before) / len(queue),
+    }))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
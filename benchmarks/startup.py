@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+# Measures the start up time of rofication-status and checks that it stays clear of
+# PyGObject and dbus-python when it is not clicked. Prints one JSON object per run.
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATUS_SCRIPT = os.path.join(ROOT, 'rofication-status')
+HEAVY_PACKAGES = ('gi', 'dbus')
+
+# runs the status script in-process and records which modules it imported
+PROBE = '''
+import runpy, sys
+try:
+    runpy.run_path(sys.argv[1], run_name='__main__')
+except Exception:
+    pass
+with open(sys.argv[2], 'w') as f:
+    f.write('\\n'.join(sorted(sys.modules)))
+'''
+
+
+def probe(env: dict) -> (float, list):
+    with tempfile.NamedTemporaryFile('r') as modules:
+        start = time.perf_counter()
+        subprocess.run((sys.executable, '-c', PROBE, STATUS_SCRIPT, modules.name),
+                       env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        elapsed = time.perf_counter() - start
+        imported = modules.read().split()
+    return elapsed, [m for m in imported if m.split('.')[0] in HEAVY_PACKAGES]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='rofication-status start up benchmark')
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    env.pop('button', None)
+
+    timings = []
+    heavy = set()
+    for _ in range(args.runs):
+        elapsed, modules = probe(env)
+        timings.append(elapsed * 1000)
+        heavy.update(modules)
+
+    timings.sort()
+    print(json.dumps({
+        'benchmark': 'startup',
+        'runs': args.runs,
+        'p50_ms': statistics.median(timings),
+        'p90_ms': timings[int(len(timings) * 0.9) - 1],
+        'heavy_modules': sorted(heavy),
+    }))
+    if heavy:
+        print(f'rofication-status imported {", ".join(sorted(heavy))} without a click', file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
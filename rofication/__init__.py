@@ -1,9 +1,48 @@
-from ._client import RoficationClient
-from ._dbus import RoficationDbusService
-from ._gui import RoficationGui
+from importlib import import_module
+
 from ._metadata import ROFICATION_NAME, ROFICATION_VERSION, ROFICATION_URL
-from ._notification import Notification, CloseReason, Urgency
-from ._queue import NotificationQueue
-from ._server import RoficationServer
 from ._static import __version__, ROFICATION_UNIX_SOCK
-from ._util import Event, Resource
+
+# public names are imported on first access, so that clients such as rofication-status
+# do not pay for dbus and GLib unless they actually use the daemon or the GUI
+_LAZY_ATTRIBUTES = {
+    'RoficationClient': '._client',
+    'RoficationSession': '._client',
+    'RenderedQueue': '._client',
+    'NotificationMirror': '._client',
+    'HistoryEntry': '._client',
+    'RoficationDbusService': '._dbus',
+    'RoficationGui': '._gui',
+    'Notification': '._notification',
+    'CloseReason': '._notification',
+    'Urgency': '._notification',
+    'NotificationQueue': '._queue',
+    'EvictionPolicy': '._queue',
+    'QueueCounts': '._queue',
+    'QueueSnapshot': '._queue',
+    'SqliteStorage': '._sqlite',
+    'RoficationServer': '._server',
+    'StatusFile': '._status',
+    'status_path': '._status',
+    'AsyncRoficationServer': '._aioserver',
+    'Dispatcher': '._util',
+    'Event': '._util',
+    'RateLimitFilter': '._util',
+    'Resource': '._util',
+}
+
+__all__ = ['ROFICATION_NAME', 'ROFICATION_VERSION', 'ROFICATION_URL', '__version__', 'ROFICATION_UNIX_SOCK',
+           *_LAZY_ATTRIBUTES]
+
+
+def __getattr__(name: str) -> any:
+    module = _LAZY_ATTRIBUTES.get(name)
+    if module is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return __all__
@@ -0,0 +1,137 @@
+import asyncio
+import io
+import os
+import threading
+from typing import Optional, MutableMapping, Set
+
+from ._metrics import Histogram
+from ._queue import NotificationQueue
+from ._render import RenderCache
+from ._server import RoficationCommands, command_histograms
+from ._static import ROFICATION_UNIX_SOCK
+
+# answered on the loop thread, they only read the published counts and never wait for the queue lock
+LOOP_COMMANDS = ('num',)
+
+
+class AsyncRoficationCommands(RoficationCommands):
+    def __init__(self, server: 'AsyncRoficationServer') -> None:
+        self.server: 'AsyncRoficationServer' = server
+
+
+class AsyncRoficationServer:
+    def __init__(self, queue: NotificationQueue, server_address: str = ROFICATION_UNIX_SOCK) -> None:
+        # pre-start cleanup
+        if os.path.exists(server_address):
+            os.remove(server_address)
+        self.server_address: str = server_address
+        self.queue: NotificationQueue = queue
+        self.render_cache: RenderCache = RenderCache()
+        self.command_latency: MutableMapping[str, Histogram] = command_histograms()
+        self._commands = AsyncRoficationCommands(self)
+        # all connections are served by this one loop, on a single thread; commands run on its executor
+        self._loop = asyncio.new_event_loop()
+        self._thread: Optional[threading.Thread] = None
+        # open connections, cancelled on exit since wait_closed() waits for them on newer Pythons
+        self._handlers: Set[asyncio.Task] = set()
+        self._server = self._loop.run_until_complete(self._start_server())
+
+    async def _start_server(self) -> asyncio.AbstractServer:
+        return await asyncio.start_unix_server(self._handle, path=self.server_address)
+
+    def __enter__(self) -> 'AsyncRoficationServer':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.shutdown()
+        self._server.close()
+        handlers = list(self._handlers)
+        for handler in handlers:
+            handler.cancel()
+        if handlers:
+            self._loop.run_until_complete(asyncio.gather(*handlers, return_exceptions=True))
+        self._loop.run_until_complete(self._server.wait_closed())
+        self._loop.close()
+        # removes the UNIX socket after use
+        os.remove(self.server_address)
+
+    def serve_forever(self) -> None:
+        self._loop.run_forever()
+
+    def start(self) -> threading.Thread:
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self._thread
+
+    def shutdown(self) -> None:
+        if self._thread is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._thread = None
+
+    def _dispatch(self, line: str) -> str:
+        out = io.StringIO()
+        self._commands.dispatch(line, out)
+        return out.getvalue()
+
+    async def _execute(self, line: str) -> str:
+        if line.partition(':')[0].strip() in LOOP_COMMANDS:
+            return self._dispatch(line)
+        # everything else may wait for the queue lock or the storage, which must not stall the other clients
+        return await self._loop.run_in_executor(None, self._dispatch, line)
+
+    async def _watch(self, writer: asyncio.StreamWriter) -> None:
+        changed = asyncio.Event()
+
+        def queue_changed():
+            # notified from whichever thread changed the queue
+            self._loop.call_soon_threadsafe(changed.set)
+
+        self.queue.queue_changed += queue_changed
+        try:
+            last = None
+            while True:
+                counts = self.queue.counts
+                current = (counts.count, counts.critical)
+                if current != last:
+                    writer.write('{},{}\n'.format(*current).encode('utf-8'))
+                    await writer.drain()
+                    last = current
+                await changed.wait()
+                changed.clear()
+        finally:
+            self.queue.queue_changed -= queue_changed
+
+    async def _session(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        # same framing as the threaded server, '<length in characters>\n<payload>'
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            payload = await self._execute(line.decode('utf-8'))
+            writer.write(f'{len(payload)}\n{payload}'.encode('utf-8'))
+            await writer.drain()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        handler = asyncio.current_task()
+        self._handlers.add(handler)
+        try:
+            line = (await reader.readline()).decode('utf-8')
+            if line.strip() == 'session':
+                await self._session(reader, writer)
+            elif line.strip() == 'watch':
+                # stream '<count>,<critical count>' lines whenever the queue changes
+                await self._watch(writer)
+            else:
+                writer.write((await self._execute(line)).encode('utf-8'))
+                await writer.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # client went away
+            pass
+        except asyncio.CancelledError:
+            # the server is exiting, ends the task normally so that asyncio has nothing to report
+            pass
+        finally:
+            self._handlers.discard(handler)
+            writer.close()
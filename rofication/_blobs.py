@@ -0,0 +1,84 @@
+import hashlib
+import os
+import re
+import time
+from typing import Optional, Mapping, Collection, Iterator
+
+# binary hints of at least this many bytes are moved out of the queue
+BLOB_THRESHOLD = 1024
+# blobs younger than this are never collected, their notification may not be queued yet
+BLOB_GRACE_PERIOD = 60
+
+DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+class BlobStore:
+    def __init__(self, directory: str) -> None:
+        self._directory: str = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, digest: str) -> str:
+        if not DIGEST_PATTERN.match(digest):
+            raise ValueError(f'Invalid blob digest {digest!r}')
+        return os.path.join(self._directory, digest)
+
+    def put(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        try:
+            # referenced again, collect() must not take it for an unused leftover
+            os.utime(path)
+        except FileNotFoundError:
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return digest
+
+    def get(self, digest: str) -> bytes:
+        with open(self._path(digest), 'rb') as f:
+            return f.read()
+
+    def collect(self, live: Collection[str]) -> None:
+        expiry = time.time() - BLOB_GRACE_PERIOD
+        for entry in os.scandir(self._directory):
+            if entry.name not in live and entry.stat().st_mtime < expiry:
+                os.unlink(entry.path)
+
+
+def normalize_hints(hints: Mapping[str, any], blobs: Optional[BlobStore] = None) -> Mapping[str, any]:
+    # D-Bus values subclass the builtin types, turn them into the plain ones
+    def normalize(value: any) -> any:
+        if isinstance(value, str):
+            return str(value)
+        if isinstance(value, float):
+            return float(value)
+        if isinstance(value, int):
+            return int(value)
+        if isinstance(value, Mapping):
+            return {str(k): normalize(v) for k, v in value.items()}
+        if isinstance(value, (bytes, bytearray)) or getattr(value, 'signature', None) == 'y':
+            data = bytes(value)
+            if blobs is not None and len(data) >= BLOB_THRESHOLD:
+                return {'$blob': blobs.put(data), 'size': len(data)}
+            return list(data)
+        if isinstance(value, (list, tuple)):
+            return [normalize(v) for v in value]
+        return value
+
+    return normalize(hints) if hints else {}
+
+
+def blob_references(hints: Mapping[str, any]) -> Iterator[str]:
+    def walk(value: any) -> Iterator[str]:
+        if isinstance(value, Mapping):
+            if '$blob' in value:
+                yield value['$blob']
+            else:
+                for v in value.values():
+                    yield from walk(v)
+        elif isinstance(value, list):
+            for v in value:
+                yield from walk(v)
+
+    return walk(hints)
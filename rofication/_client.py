@@ -1,15 +1,50 @@
+import base64
 import json
 import socket
-from typing import TextIO, Sequence
+from array import array
+from typing import TextIO, Sequence, Optional, Iterator, Tuple, NamedTuple, Mapping, MutableMapping, Union
+from urllib.parse import urlencode
 
-from ._notification import Notification
+from ._notification import Notification, Urgency, CloseReason, ApplicationSummary
 from ._static import ROFICATION_UNIX_SOCK, nullio
+from ._status import read_status, status_path
+
+# upper bound of unread pipelined responses, keeps both socket buffers from filling up
+MAX_PENDING_RESPONSES = 512
+# bytes read from the socket at a time when streaming rendered rows
+RENDER_CHUNK_SIZE = 64 * 1024
+
+
+class RenderedQueue(NamedTuple):
+    ids: Sequence[int]
+    applications: Sequence[str]
+    urgent: Sequence[int]
+    low: Sequence[int]
+    # rofi rows, each terminated by NUL; chunks that do not respect row boundaries when streamed
+    entries: Union[bytes, Iterator[bytes]]
+
+
+class HistoryEntry(NamedTuple):
+    notification: Notification
+    closed: float
+    reason: CloseReason
+
+
+def make_filter(application: Optional[str] = None, urgency: Optional[Urgency] = None,
+                since: Optional[float] = None, until: Optional[float] = None, age: Optional[float] = None,
+                min_id: Optional[int] = None, max_id: Optional[int] = None,
+                offset: int = 0, limit: Optional[int] = None) -> str:
+    params = (('app', application), ('urgency', None if urgency is None else int(urgency)),
+              ('since', since), ('until', until), ('age', age), ('min_id', min_id), ('max_id', max_id),
+              ('offset', offset or None), ('limit', limit))
+    return urlencode([(key, value) for key, value in params if value is not None])
 
 
 class RoficationClient:
     def __init__(self, out: TextIO = nullio, unix_socket: str = ROFICATION_UNIX_SOCK):
         self._out: TextIO = out
         self._unix_socket: str = unix_socket
+        self._status_file: str = status_path(unix_socket)
 
     def _client_socket(self) -> socket.socket:
         sck = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
@@ -18,28 +53,231 @@ class RoficationClient:
 
     def _send(self, command: str, arg: any) -> None:
         with self._client_socket() as sck:
-            sck.send(bytes(f'{command}:{arg}\n', encoding='utf-8'))
+            sck.sendall(bytes(f'{command}:{arg}\n', encoding='utf-8'))
 
-    def count(self) -> (int, int):
+    def _request(self, command: str) -> str:
+        with self._client_socket() as sck:
+            sck.sendall(bytes(f'{command}\n', encoding='utf-8'))
+            with sck.makefile(mode='r', encoding='utf-8', newline='') as fp:
+                return fp.read()
+
+    def _request_bytes(self, command: str) -> bytes:
         with self._client_socket() as sck:
-            sck.send(b'num\n')
-            data = sck.recv(32).decode('utf-8')
-            return (int(x) for x in data.split(',', 2))
+            sck.sendall(bytes(f'{command}\n', encoding='utf-8'))
+            with sck.makefile(mode='rb') as fp:
+                return fp.read()
+
+    def session(self) -> 'RoficationSession':
+        return RoficationSession(self._out, self._unix_socket)
+
+    def blob(self, digest: str) -> Optional[bytes]:
+        data = self._request(f'blob:{digest}')
+        return base64.b64decode(data) if data else None
+
+    def count(self) -> (int, int):
+        # the status file the daemon keeps up to date saves the round trip
+        status = read_status(self._status_file)
+        if status is not None:
+            return status
+        data = self._request('num')
+        return (int(x) for x in data.split(',', 2))
 
     def delete(self, nid: int) -> None:
         self._send('del', nid)
 
     def delete_multi(self, ids: str) -> None:
-            self._send('delm', ids)
+        self._send('delm', ids)
 
     def delete_all(self, application: str) -> None:
         self._send('dela', application)
 
-    def list(self) -> Sequence[Notification]:
+    def delete_where(self, **filters) -> int:
+        # without filters this dismisses the whole queue
+        return int(self._request(f'delq:{make_filter(**filters)}'))
+
+    def list(self, **filters) -> Sequence[Notification]:
+        query = make_filter(**filters)
+        command = f'list:{query}' if query else 'list'
+        return [Notification.make(dct) for dct in json.loads(self._request(command))]
+
+    def stream(self, **filters) -> Iterator[Notification]:
+        for line in self._stream_lines(f'stream:{make_filter(**filters)}'):
+            yield Notification.make(json.loads(line))
+
+    def _stream_lines(self, command: str) -> Iterator[str]:
         with self._client_socket() as sck:
-            sck.send(b'list\n')
-            with sck.makefile(mode='r', encoding='utf-8') as fp:
-                return json.load(fp, object_hook=Notification.make)
+            sck.sendall(bytes(f'{command}\n', encoding='utf-8'))
+            with sck.makefile(mode='r', encoding='utf-8', newline='') as fp:
+                yield from fp
+
+    def render(self, tsformat: str = '') -> RenderedQueue:
+        header, _, entries = self._request_bytes(f'render:{tsformat}').partition(b'\n')
+        return RenderedQueue(entries=entries, **json.loads(header))
+
+    def groups(self) -> Sequence[ApplicationSummary]:
+        return [ApplicationSummary(**{**group, 'urgency': Urgency(group['urgency'])})
+                for group in json.loads(self._request('groups'))]
+
+    def history(self, **filters) -> Sequence[HistoryEntry]:
+        query = make_filter(**filters)
+        return [HistoryEntry(Notification.make(entry['notification']), entry['closed'], CloseReason(entry['reason']))
+                for entry in json.loads(self._request(f'history:{query}'))]
+
+    def render_stream(self, tsformat: str = '', **filters) -> RenderedQueue:
+        if filters:
+            command = f'renderq:{urlencode([("ts", tsformat)])}&{make_filter(**filters)}'
+        else:
+            command = f'render:{tsformat}'
+        # the rows arrive while the caller consumes them, always on a connection of its own
+        sck = self._client_socket()
+        sck.sendall(bytes(f'{command}\n', encoding='utf-8'))
+        fp = sck.makefile(mode='rb')
+        header = json.loads(fp.readline())
+
+        def entries() -> Iterator[bytes]:
+            with sck, fp:
+                yield from iter(lambda: fp.read1(RENDER_CHUNK_SIZE), b'')
+
+        # only what maps a selected row back to its notification and application is kept
+        return RenderedQueue(ids=array('L', header['ids']), applications=header['applications'],
+                             urgent=header['urgent'], low=header['low'], entries=entries())
 
     def see(self, nid: int) -> None:
         self._send('see', nid)
+
+    def see_where(self, **filters) -> int:
+        return int(self._request(f'seeq:{make_filter(**filters)}'))
+
+    def search(self, query: str) -> Sequence[int]:
+        # the query ends at the line break, like every other argument
+        return json.loads(self._request(f'search:{" ".join(query.split())}'))
+
+    def since(self, version: int) -> Mapping[str, any]:
+        return json.loads(self._request(f'since:{version}'))
+
+    def stats(self) -> Mapping[str, any]:
+        return json.loads(self._request('stats'))
+
+    def watch(self) -> Iterator[Tuple[int, int]]:
+        with self._client_socket() as sck:
+            sck.sendall(b'watch\n')
+            with sck.makefile(mode='r', encoding='utf-8', newline='') as fp:
+                for line in fp:
+                    num, crit = line.split(',', 2)
+                    yield int(num), int(crit)
+
+
+class RoficationSession(RoficationClient):
+    def __init__(self, out: TextIO = nullio, unix_socket: str = ROFICATION_UNIX_SOCK):
+        super().__init__(out, unix_socket)
+        self._sck: Optional[socket.socket] = None
+        self._rfile: Optional[TextIO] = None
+        self._wfile: Optional[TextIO] = None
+        # responses of pipelined commands that have not been read yet
+        self._pending: int = 0
+
+    def __enter__(self) -> 'RoficationSession':
+        self.open()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def open(self) -> None:
+        self._sck = self._client_socket()
+        # no newline translation, frame lengths count a '\r\n' in a payload as two characters
+        self._rfile = self._sck.makefile(mode='r', encoding='utf-8', newline='')
+        self._wfile = self._sck.makefile(mode='w', encoding='utf-8', newline='')
+        self._wfile.write('session\n')
+
+    def close(self) -> None:
+        if self._sck is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self._wfile.close()
+            self._rfile.close()
+            self._sck.close()
+            self._sck = None
+
+    def _read_response(self) -> str:
+        header = self._rfile.readline()
+        if not header:
+            raise ConnectionResetError('rofication session closed by the server')
+        return self._rfile.read(int(header))
+
+    def flush(self) -> None:
+        self._wfile.flush()
+        while self._pending:
+            self._read_response()
+            self._pending -= 1
+
+    def _send(self, command: str, arg: any) -> None:
+        # the empty response is collected lazily, which pipelines bulk operations
+        self._wfile.write(f'{command}:{arg}\n')
+        self._pending += 1
+        if self._pending >= MAX_PENDING_RESPONSES:
+            self.flush()
+
+    def _request(self, command: str) -> str:
+        self._wfile.write(f'{command}\n')
+        self.flush()
+        return self._read_response()
+
+    def _request_bytes(self, command: str) -> bytes:
+        return self._request(command).encode('utf-8')
+
+    def _stream_lines(self, command: str) -> Iterator[str]:
+        # responses are framed as a whole, the lines are split client side
+        yield from self._request(command).splitlines()
+
+    def count(self) -> (int, int):
+        # the status file is only current once the daemon has handled the pipelined commands
+        self.flush()
+        return super().count()
+
+    def render_stream(self, tsformat: str = '', **filters) -> RenderedQueue:
+        # rendered on another connection, pipelined commands have to reach the daemon first
+        self.flush()
+        return super().render_stream(tsformat, **filters)
+
+
+class NotificationMirror:
+    def __init__(self, client: RoficationClient) -> None:
+        self._client: RoficationClient = client
+        self._epoch: Optional[str] = None
+        self._version: int = 0
+        self._notifications: MutableMapping[int, Notification] = {}
+
+    def __len__(self) -> int:
+        return len(self._notifications)
+
+    def __iter__(self) -> Iterator[Notification]:
+        return iter(self._notifications.values())
+
+    def sync(self) -> bool:
+        # -1 is never covered by the change log and always answers with a resync
+        response = self._client.since(self._version if self._epoch is not None else -1)
+        changed = False
+        if response['epoch'] != self._epoch and not response.get('resync'):
+            # a different daemon answered, its versions do not relate to ours
+            response = self._client.since(-1)
+        if response.get('resync'):
+            self._notifications = {n.id: n for n in map(Notification.make, response['notifications'])}
+            changed = True
+        else:
+            for change in response['changes']:
+                op, nid = change['op'], change['id']
+                if op == 'remove':
+                    self._notifications.pop(nid, None)
+                elif op == 'see':
+                    if nid in self._notifications:
+                        self._notifications[nid].urgency = Urgency.NORMAL
+                        self._notifications[nid].seen = True
+                else:
+                    self._notifications[nid] = Notification.make(change['notification'])
+                changed = True
+        self._epoch = response['epoch']
+        self._version = response['version']
+        return changed
@@ -1,13 +1,15 @@
 import time
-from typing import Tuple, Sequence, Mapping
+from typing import Tuple, Sequence, Mapping, Optional
 
 from dbus import service, SessionBus
 from dbus.mainloop.glib import DBusGMainLoop
-from gi.repository.GLib import MainLoop
+from gi.repository import GLib
 
+from ._blobs import normalize_hints
 from ._metadata import ROFICATION_VERSION, ROFICATION_NAME, ROFICATION_URL
-from ._notification import Notification, Urgency
+from ._notification import Notification, Urgency, CloseReason, intern
 from ._queue import NotificationQueue
+from ._util import Dispatcher
 from datetime import datetime
 
 NOTIFICATIONS_DBUS_INTERFACE = 'org.freedesktop.Notifications'
@@ -24,17 +26,47 @@ class RoficationDbusObject(service.Object):
             )
         )
         self._queue: NotificationQueue = queue
+        # signals are emitted from the main loop once the queue lock has been released; idle sources of
+        # equal priority run in the order they were added, returning None removes them
+        self.dispatcher: Dispatcher = Dispatcher(GLib.idle_add)
+        self._queue.dispatchers['dbus'] = self.dispatcher
+        self._expiry_source: Optional[int] = None
+        self._expiry_deadline: Optional[float] = None
 
         def notification_seen(notification):
             if 'default' in notification.actions:
                 self.ActionInvoked(notification.id, 'default')
 
-        self._queue.notification_seen += notification_seen
+        self._queue.notification_seen.subscribe(notification_seen, self.dispatcher)
 
-        def notification_closed(notification, reason):
-            self.NotificationClosed(notification.id, reason)
+        def notifications_closed(notifications, reason):
+            for notification in notifications:
+                self.NotificationClosed(notification.id, reason)
 
-        self._queue.notification_closed += notification_closed
+        self._queue.notifications_closed.subscribe(notifications_closed, self.dispatcher)
+        self._schedule_expiry()
+
+    def _schedule_expiry(self) -> None:
+        with self._queue.lock:
+            deadline = self._queue.next_deadline()
+        if deadline == self._expiry_deadline:
+            return
+        if self._expiry_source is not None:
+            GLib.source_remove(self._expiry_source)
+            self._expiry_source = None
+        self._expiry_deadline = deadline
+        if deadline is not None:
+            delay = max(0, int((deadline - time.time()) * 1000) + 1)
+            self._expiry_source = GLib.timeout_add(delay, self._expire)
+
+    def _expire(self) -> bool:
+        self._expiry_source = None
+        self._expiry_deadline = None
+        with self._queue.lock:
+            self._queue.cleanup()
+        self._schedule_expiry()
+        # one-shot source, the next one is scheduled above
+        return False
 
     @service.signal(NOTIFICATIONS_DBUS_INTERFACE, signature='us')
     def ActionInvoked(self, id_in, action_key_in):
@@ -43,7 +75,7 @@ class RoficationDbusObject(service.Object):
     @service.method(NOTIFICATIONS_DBUS_INTERFACE, in_signature='u', out_signature='')
     def CloseNotification(self, id: int) -> None:
         with self._queue.lock:
-            self._queue.remove(id)
+            self._queue.remove(id, CloseReason.CLOSED)
 
     @service.method(NOTIFICATIONS_DBUS_INTERFACE, in_signature='', out_signature='as')
     def GetCapabilities(self) -> Sequence[str]:
@@ -62,19 +94,21 @@ class RoficationDbusObject(service.Object):
                body: str, actions: Sequence[str], hints: Mapping[str, any], expire_timeout: int) -> int:
         notification = Notification()
         notification.id = replaces_id
-        notification.application = app_name
-        notification.icon = app_icon
-        notification.summary = summary
-        notification.body = body
-        notification.hints = hints
+        notification.application = intern(app_name)
+        notification.icon = intern(app_icon)
+        notification.summary = intern(summary)
+        notification.body = str(body)
+        notification.hints = normalize_hints(hints, self._queue.blobs)
         notification.timestamp = datetime.now().timestamp()
-        notification.actions = tuple(actions)
+        notification.actions = tuple(map(intern, actions))
         if int(expire_timeout) > 0:
             notification.deadline = time.time() + expire_timeout / 1000.0
         if 'urgency' in hints:
             notification.urgency = Urgency(int(hints['urgency']))
         with self._queue.lock:
             self._queue.put(notification)
+        if notification.deadline is not None:
+            self._schedule_expiry()
         return notification.id
 
 
@@ -83,7 +117,7 @@ class RoficationDbusService:
         # preserve D-Bus object reference
         self._object = RoficationDbusObject(queue)
         # create GLib mainloop, this is needed to make D-Bus work and takes care of catching signals.
-        self._loop = MainLoop()
+        self._loop = GLib.MainLoop()
 
     def run(self) -> None:
         self._loop.run()
@@ -1,17 +1,13 @@
-import re
 import struct
 import subprocess
-from typing import Iterable, List
-from datetime import datetime
-
-from gi.repository import GLib
+import threading
+from typing import Iterable, Iterator, List, Union
 
 from ._client import RoficationClient
-from ._notification import Urgency, Notification
+from ._notification import Urgency
+from ._render import rofi_group_entry
 from ._util import Resource
 
-HTML_TAGS_PATTERN = re.compile(r'<[^>]*?>')
-
 ROFI_COMMAND = ('rofi',
                 '-dmenu',
                 '-p', 'Notifications',
@@ -27,34 +23,47 @@ ROFI_COMMAND = ('rofi',
                 '-sep', '\\0',
                 '-format', 'i',
                 '-eh', '2',
-                '-lines', '10')
-
+                '-lines', '10',
+                # show the first rows right away, the rest is read while the menu is open
+                '-async-pre-read', '25')
 
-def strip_tags(value: str) -> str:
-    return GLib.markup_escape_text(HTML_TAGS_PATTERN.sub('', value))
 
+def rofi_input(entries: Union[Iterable[str], Iterable[bytes], bytes]) -> Iterator[bytes]:
+    if isinstance(entries, bytes):
+        yield entries
+        return
+    for entry in entries:
+        if isinstance(entry, str):
+            yield entry.encode('utf-8')
+            yield struct.pack('B', 0)
+        else:
+            # already NUL separated
+            yield entry
 
-def rofi_entry(notification: Notification, tsformat: str) -> str:
-    stripped_summ = strip_tags(notification.summary)
-    stripped_app = strip_tags(notification.application)
-    stripped_body = strip_tags(' '.join(notification.body.split()))
-    formatted_ts = f"{datetime.fromtimestamp(notification.timestamp).strftime(tsformat)} " if tsformat else ""
-    return f'<b>{formatted_ts}{stripped_summ}</b> <small>({stripped_app})</small>\n<small>{stripped_body}</small>'
 
-def call_rofi(entries: Iterable[str], additional_args: List[str] = None) -> (int, int):
+def call_rofi(entries: Union[Iterable[str], Iterable[bytes], bytes], additional_args: List[str] = None) -> (int, int):
     command = ROFI_COMMAND
     if additional_args is not None:
         command = list(command) + additional_args
 
     proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
 
-    with proc.stdin as stdin:
-        for e in entries:
-            stdin.write(e.encode('utf-8'))
-            stdin.write(struct.pack('B', 0))
-
+    def feed():
+        try:
+            with proc.stdin as stdin:
+                for data in rofi_input(entries):
+                    stdin.write(data)
+        except BrokenPipeError:
+            # a row was picked before all of them were written
+            pass
+
+    # rofi is fed while it is already showing the menu
+    feeder = threading.Thread(target=feed)
+    feeder.daemon = True
+    feeder.start()
     selected = proc.stdout.read().decode('utf-8')
     exit_code = proc.wait()
+    feeder.join()
 
     if selected:
         return int(selected), exit_code
@@ -63,27 +72,28 @@ def call_rofi(entries: Iterable[str], additional_args: List[str] = None) -> (int
 
 
 class RoficationGui():
-    def __init__(self, client: RoficationClient = None):
+    def __init__(self, client: RoficationClient = None, grouped: bool = False):
         self._client: RoficationClient = RoficationClient() if client is None else client
+        self._grouped: bool = grouped
         self._tsformat = Resource(env_name='i3xrocks_notify_timestamp_format', xres_name='i3xrocks.notify.timestamp.format', default='').fetch()
 
     def run(self) -> None:
+        # one connection for the whole interaction instead of one per command
+        with self._client.session() as client:
+            if self._grouped:
+                self._run_grouped(client)
+            else:
+                self._run(client)
+
+    def _run_grouped(self, client: RoficationClient) -> None:
+        # one row per application, built from the daemon's aggregates without listing the queue
         selected = 0
         while selected >= 0:
-            notifications = []
-            entries = []
-            urgent = []
-            low = []
             args = []
 
-            # reassigns indices of notifications
-            for index, notification in enumerate(self._client.list()):
-                notifications.append(notification)
-                entries.append(rofi_entry(notification, self._tsformat))
-                if notification.urgency == Urgency.CRITICAL:
-                    urgent.append(str(index))
-                if notification.urgency == Urgency.LOW:
-                    low.append(str(index))
+            groups = client.groups()
+            urgent = [str(index) for index, group in enumerate(groups) if group.urgency == Urgency.CRITICAL]
+            low = [str(index) for index, group in enumerate(groups) if group.urgency == Urgency.LOW]
 
             if urgent:
                 args.append('-u')
@@ -98,23 +108,66 @@ class RoficationGui():
                 args.append(str(selected))
 
             # Show rofi
-            selected, exit_code = call_rofi(entries, args)
+            selected, exit_code = call_rofi((rofi_group_entry(group, self._tsformat) for group in groups), args)
+
+            if 0 <= selected < len(groups):
+                # Dismiss all notifications for application
+                if exit_code in (10, 13):
+                    client.delete_all(groups[selected].application)
+                    # This was the last group of notifications
+                    if len(groups) == 1:
+                        break
+                # Expand the group, leaving it returns here
+                elif exit_code in (0, 11):
+                    self._run(client, application=groups[selected].application)
+                elif exit_code != 12:
+                    break
+
+    def _run(self, client: RoficationClient, application: str = None) -> None:
+        selected = 0
+        while selected >= 0:
+            args = []
+
+            # rows are rendered by the daemon and streamed into rofi, only their ids are kept here
+            if application is None:
+                rendered = client.render_stream(self._tsformat)
+            else:
+                rendered = client.render_stream(self._tsformat, application=application)
+
+            if rendered.urgent:
+                args.append('-u')
+                args.append(','.join(map(str, rendered.urgent)))
+
+            if rendered.low:
+                args.append('-a')
+                args.append(','.join(map(str, rendered.low)))
 
             if selected >= 0:
+                args.append('-selected-row')
+                args.append(str(selected))
+
+            # Show rofi
+            try:
+                selected, exit_code = call_rofi(rendered.entries, args)
+            finally:
+                rendered.entries.close()
+
+            if 0 <= selected < len(rendered.ids):
+                nid = rendered.ids[selected]
                 # Dismiss notification
                 if exit_code == 10:
-                    self._client.delete(notifications[selected].id)
+                    client.delete(nid)
                     # This was the last notification
-                    if len(notifications) == 1:
+                    if len(rendered.ids) == 1:
                         break
                 # Seen notification
                 elif exit_code == 11:
-                    self._client.see(notifications[selected].id)
+                    client.see(nid)
                 # Dismiss all notifications for application
                 elif exit_code == 13:
-                    self._client.delete_all(notifications[selected].application)
+                    client.delete_all(rendered.applications[selected])
                     # This was the last group of notifications
-                    if len(notifications) == 1:
+                    if len(rendered.ids) == 1:
                         break
                 elif exit_code != 12:
                     break
@@ -0,0 +1,153 @@
+import json
+import logging
+import os
+import shutil
+from typing import MutableMapping, Optional, Sequence, Mapping, TextIO, List
+
+from ._notification import Notification, Urgency, CloseReason
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationJournal:
+    # compaction replaces the journal with a snapshot of the whole queue
+    needs_snapshot: bool = True
+
+    def __init__(self, filename: str) -> None:
+        # snapshot keeps the historic notifications.json format, the journal
+        # holds one JSON record per mutation applied after the snapshot
+        self._snapshot_file: str = filename
+        self._journal_file: str = os.path.splitext(filename)[0] + '.journal'
+        self._rotated_file: str = self._journal_file + '.1'
+        self._fp: Optional[TextIO] = None
+        self._records: int = 0
+
+    @property
+    def records(self) -> int:
+        return self._records
+
+    def replay(self) -> MutableMapping[int, Notification]:
+        mapping: MutableMapping[int, Notification] = {}
+        if os.path.exists(self._snapshot_file):
+            try:
+                logger.info('Loading notification queue from %s', self._snapshot_file)
+                with open(self._snapshot_file, 'r') as f:
+                    # top-level only, an object_hook would also turn hints into notifications
+                    mapping = {n.id: n for n in map(Notification.make, json.load(f))}
+            except:
+                logger.exception('Failed to load notification queue')
+                mapping = {}
+        # a rotated journal is only left behind if the last compaction did not finish
+        for filename in (self._rotated_file, self._journal_file):
+            if os.path.exists(filename):
+                self._records += self._replay_file(filename, mapping)
+        return mapping
+
+    @staticmethod
+    def _replay_file(filename: str, mapping: MutableMapping[int, Notification]) -> int:
+        count = 0
+        with open(filename, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # torn write at the tail of the journal
+                    logger.warning('Skipping corrupt journal record in %s', filename)
+                    continue
+                op = record.get('op')
+                if op == 'put':
+                    notification = Notification.make(record['notification'])
+                    mapping[notification.id] = notification
+                elif op == 'remove':
+                    mapping.pop(record['id'], None)
+                elif op == 'see':
+                    if record['id'] in mapping:
+                        mapping[record['id']].urgency = Urgency.NORMAL
+                        mapping[record['id']].seen = True
+                count += 1
+        return count
+
+    @staticmethod
+    def _terminate(filename: str) -> None:
+        # a torn record left behind by a crash has to stay on a line of its own, otherwise the next
+        # record is glued onto it and skipped together with it on replay
+        try:
+            with open(filename, 'rb+') as f:
+                if f.seek(0, os.SEEK_END) == 0:
+                    return
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+        except FileNotFoundError:
+            pass
+
+    def open(self) -> None:
+        self._terminate(self._journal_file)
+        self._fp = open(self._journal_file, 'a')
+
+    def close(self) -> None:
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+    def _append(self, record: Mapping[str, any]) -> None:
+        if self._fp is None:
+            return
+        try:
+            self._fp.write(json.dumps(record, default=Notification.asdict))
+            self._fp.write('\n')
+            self._fp.flush()
+            self._records += 1
+        except:
+            logger.exception('Failed to append to notification journal')
+
+    def put(self, notification: Notification) -> None:
+        self._append({'op': 'put', 'notification': notification})
+
+    def remove(self, nid: int, reason: CloseReason) -> None:
+        self._append({'op': 'remove', 'id': nid})
+
+    def see(self, nid: int) -> None:
+        self._append({'op': 'see', 'id': nid})
+
+    def rotate(self) -> None:
+        # must be called with the queue lock held, so that the rotated journal
+        # contains exactly the records that lead to the snapshot being taken
+        self.close()
+        if not os.path.exists(self._journal_file):
+            pass
+        elif os.path.exists(self._rotated_file):
+            # previous compaction failed, keep its records in front of ours
+            self._terminate(self._rotated_file)
+            with open(self._rotated_file, 'a') as dst, open(self._journal_file, 'r') as src:
+                shutil.copyfileobj(src, dst)
+            os.unlink(self._journal_file)
+        else:
+            os.rename(self._journal_file, self._rotated_file)
+        self._records = 0
+        self.open()
+
+    def write_snapshot(self, notifications: Sequence[Mapping[str, any]]) -> None:
+        # the queue serializes compactions, a snapshot is never replaced by an older one
+        tmp_file = self._snapshot_file + '.tmp'
+        try:
+            with open(tmp_file, 'w') as f:
+                json.dump(notifications, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self._snapshot_file)
+        except:
+            logger.exception('Failed to save notification queue')
+            if os.path.exists(tmp_file):
+                os.unlink(tmp_file)
+            return
+        if os.path.exists(self._rotated_file):
+            os.unlink(self._rotated_file)
+
+    def maintain(self) -> None:
+        # nothing to do besides compaction
+        pass
+
+    def history(self, **filters) -> List[Mapping[str, any]]:
+        # flat files keep no archive of closed notifications
+        return []
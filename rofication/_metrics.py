@@ -0,0 +1,112 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from typing import Sequence, Mapping, List, Deque
+
+# upper bounds of the latency buckets in seconds, the last bucket is unbounded
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                   0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+# seconds covered by a RateMeter
+RATE_WINDOW = 60
+
+
+class Histogram:
+    def __init__(self, bounds: Sequence[float] = LATENCY_BUCKETS) -> None:
+        self._lock = threading.Lock()
+        self._bounds: Sequence[float] = bounds
+        self._counts: List[int] = [0] * (len(bounds) + 1)
+        self._count: int = 0
+        self._sum: float = 0
+        self._max: float = 0
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self._bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._count += 1
+            self._sum += value
+            if value > self._max:
+                self._max = value
+
+    def _quantile(self, fraction: float) -> float:
+        # upper bound of the bucket holding the quantile, the maximum for the unbounded one
+        rank = fraction * self._count
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if count and seen >= rank:
+                return self._bounds[index] if index < len(self._bounds) else self._max
+        return 0.0
+
+    def asdict(self) -> Mapping[str, any]:
+        with self._lock:
+            return {
+                'count': self._count,
+                'sum': self._sum,
+                'max': self._max,
+                'p50': self._quantile(0.5),
+                'p99': self._quantile(0.99),
+                # [upper bound, count] pairs, null stands for infinity
+                'buckets': [[bound, count] for bound, count in zip((*self._bounds, None), self._counts) if count],
+            }
+
+
+class InstrumentedLock:
+    # drop-in for threading.Lock that records how long threads wait for it and hold it
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._acquired: float = 0
+        self.wait: Histogram = Histogram()
+        self.hold: Histogram = Histogram()
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        start = time.perf_counter()
+        if not self._lock.acquire(blocking, timeout):
+            return False
+        self._acquired = time.perf_counter()
+        self.wait.observe(self._acquired - start)
+        return True
+
+    def release(self) -> None:
+        # observed before releasing, while _acquired still belongs to this holder
+        self.hold.observe(time.perf_counter() - self._acquired)
+        self._lock.release()
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    def __enter__(self) -> bool:
+        return self.acquire()
+
+    def __exit__(self, *args) -> None:
+        self.release()
+
+
+class RateMeter:
+    def __init__(self, window: int = RATE_WINDOW) -> None:
+        self._lock = threading.Lock()
+        self._window: int = window
+        # [second, events] pairs, oldest first
+        self._seconds: Deque[List[int]] = deque()
+        self.total: int = 0
+
+    def _expire(self, now: int) -> None:
+        while self._seconds and self._seconds[0][0] <= now - self._window:
+            self._seconds.popleft()
+
+    def mark(self) -> None:
+        now = int(time.monotonic())
+        with self._lock:
+            self.total += 1
+            if self._seconds and self._seconds[-1][0] == now:
+                self._seconds[-1][1] += 1
+            else:
+                self._seconds.append([now, 1])
+                self._expire(now)
+
+    def rate(self) -> float:
+        # events per second over the trailing window
+        with self._lock:
+            self._expire(int(time.monotonic()))
+            return sum(events for _, events in self._seconds) / self._window
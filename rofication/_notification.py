@@ -1,5 +1,7 @@
+import sys
 from enum import IntEnum
-from typing import Sequence, Optional, Mapping
+from operator import attrgetter
+from typing import Sequence, Optional, Mapping, NamedTuple
 
 class Urgency(IntEnum):
     LOW = 0
@@ -14,7 +16,20 @@ class CloseReason(IntEnum):
     RESERVED = 4
 
 
+# serialized fields, in the order they are written
+NOTIFICATION_FIELDS = ('id', 'deadline', 'summary', 'body', 'application', 'icon',
+                       'urgency', 'actions', 'hints', 'timestamp', 'seen', 'occurrences')
+notification_values = attrgetter(*NOTIFICATION_FIELDS)
+
+
+def intern(value: Optional[str]) -> Optional[str]:
+    # chatty applications repeat the same strings, share a single copy of them
+    return None if value is None else sys.intern(str(value))
+
+
 class Notification:
+    __slots__ = (*NOTIFICATION_FIELDS, '__weakref__')
+
     def __init__(self) -> None:
         self.id: Optional[int] = None
         self.deadline: Optional[float] = None
@@ -26,21 +41,35 @@ class Notification:
         self.actions: Sequence[str] = ()
         self.hints: Mapping[str, any] = {}
         self.timestamp = None
+        self.seen: bool = False
+        self.occurrences: int = 1
 
     def asdict(self) -> Mapping[str, any]:
-        return {field: value for field, value in vars(self).items() if value is not None}
+        return {field: value for field, value in zip(NOTIFICATION_FIELDS, notification_values(self)) if value is not None}
 
     @classmethod
     def make(cls, dct: Mapping[str, any]) -> 'Notification':
         notification: 'Notification' = cls()
         notification.id = dct.get('id')
         notification.deadline = dct.get('deadline')
-        notification.summary = dct.get('summary')
+        notification.summary = intern(dct.get('summary'))
         notification.body = dct.get('body')
-        notification.application = dct.get('application')
-        notification.icon = dct.get('icon')
+        notification.application = intern(dct.get('application'))
+        notification.icon = intern(dct.get('icon'))
         notification.urgency = Urgency(dct.get('urgency', Urgency.NORMAL))
-        notification.actions = tuple(dct.get('actions', ()))
+        notification.actions = tuple(map(intern, dct.get('actions', ())))
         notification.hints = dct.get('hints')
         notification.timestamp = dct.get('timestamp', '')
+        notification.seen = bool(dct.get('seen', False))
+        notification.occurrences = dct.get('occurrences', 1)
         return notification
+
+
+class ApplicationSummary(NamedTuple):
+    application: str
+    count: int
+    # highest urgency among the application's notifications
+    urgency: Urgency
+    # summary and timestamp of its newest notification
+    summary: str
+    timestamp: Optional[float]
@@ -1,24 +1,102 @@
+import copy
+import heapq
+import itertools
 import json
+import logging
 import os
 import threading
 import time
-from typing import Iterable, Iterator, MutableMapping, Mapping, Optional
-from warnings import warn
+import uuid
+from collections import deque
+from enum import Enum
+from typing import Iterable, Iterator, MutableMapping, Mapping, Optional, Collection, List, Tuple, Deque, \
+    NamedTuple
 
-from ._notification import Notification, CloseReason, Urgency
-from ._util import Event
+from ._blobs import BlobStore, blob_references
+from ._journal import NotificationJournal
+from ._metrics import InstrumentedLock, RateMeter
+from ._notification import Notification, CloseReason, Urgency, ApplicationSummary
+from ._search import SearchIndex
+from ._util import Dispatcher, Event
 
 ALLOWED_TO_EXPIRE = ('notify-send',)
 SINGLE_NOTIFICATION_APPS = ('VLC media player',)
+# number of changes kept for delta sync, older clients have to resync
+CHANGELOG_SIZE = 1024
+
+logger = logging.getLogger(__name__)
+
+
+def content_key(notification: Notification) -> Tuple[str, str, str]:
+    return notification.application, notification.summary, notification.body
+
+
+class QueueCounts(NamedTuple):
+    version: int
+    count: int
+    critical: int
+
+
+class QueueSnapshot(NamedTuple):
+    version: int
+    count: int
+    critical: int
+    notifications: Tuple[Notification, ...]
+
+
+class EvictionPolicy(Enum):
+    OLDEST = 'oldest'
+    LOWEST_URGENCY = 'urgency'
+    SEEN = 'seen'
 
 
 class NotificationQueue:
-    def __init__(self, mapping: Mapping[int, Notification] = None) -> None:
-        self._lock = threading.Lock()
+    def __init__(self, mapping: Mapping[int, Notification] = None,
+                 journal: Optional[NotificationJournal] = None, blobs: Optional[BlobStore] = None,
+                 capacity: Optional[int] = None, application_quota: Optional[int] = None,
+                 eviction: EvictionPolicy = EvictionPolicy.OLDEST, coalesce_window: float = 0) -> None:
+        self._lock = InstrumentedLock()
+        # held from rotating the journal until its snapshot is written, compactions must not overtake each other
+        self._compaction_lock = threading.Lock()
         self._last_id: int = max(mapping.keys()) + 1 if mapping else 1
         self._mapping: MutableMapping[int, Notification] = {} if mapping is None else dict(mapping)
+        self._journal: Optional[NotificationJournal] = journal
+        self.blobs: Optional[BlobStore] = blobs
+        self._capacity: Optional[int] = capacity
+        self._application_quota: Optional[int] = application_quota
+        self._eviction: EvictionPolicy = eviction
+        self.evictions: int = 0
+        self.expirations: int = 0
+        self.received: RateMeter = RateMeter()
+        self._coalesce_window: float = coalesce_window
+        # secondary indexes, dicts are used as insertion ordered sets
+        self._by_application: MutableMapping[str, MutableMapping[int, None]] = {}
+        self._by_urgency: Mapping[Urgency, MutableMapping[int, None]] = {urgency: {} for urgency in Urgency}
+        self._seen: MutableMapping[int, None] = {}
+        # per application aggregates: notifications per urgency and the most recently put id
+        self._application_urgencies: MutableMapping[str, List[int]] = {}
+        self._newest: MutableMapping[str, int] = {}
+        # latest notification per (application, summary, body), duplicates fold into it
+        self._by_content: MutableMapping[Tuple[str, str, str], int] = {}
+        # full text over summary, body and application
+        self._search_index: SearchIndex = SearchIndex()
+        # min-heap of (deadline, id), entries of removed or replaced notifications are dropped lazily
+        self._deadlines: List[Tuple[float, int]] = []
+        # identifies this queue instance, versions of a previous daemon are meaningless
+        self._epoch: str = uuid.uuid4().hex
+        self._version: int = 0
+        self._changes: Deque[Tuple[int, str, int, Optional[Notification]]] = deque(maxlen=CHANGELOG_SIZE)
+        for notification in self._mapping.values():
+            self._index(notification)
+            self._schedule(notification)
         self.notification_seen = Event()
-        self.notification_closed = Event()
+        # notified once per batch with the closed notifications and the reason
+        self.notifications_closed = Event()
+        self.queue_changed = Event()
+        # dispatchers delivering this queue's events, by name, so that stats can report their backlog
+        self.dispatchers: MutableMapping[str, Dispatcher] = {}
+        self._counts: QueueCounts = self._make_counts()
+        self._snapshot: QueueSnapshot = self._make_snapshot()
 
     def __len__(self) -> int:
         return len(self._mapping)
@@ -27,83 +105,377 @@ class NotificationQueue:
         return iter(self._mapping.values())
 
     @property
-    def lock(self) -> threading.Lock:
+    def lock(self) -> InstrumentedLock:
         return self._lock
 
+    @property
+    def counts(self) -> QueueCounts:
+        # safe without the lock, published on every change
+        return self._counts
+
+    @property
+    def snapshot(self) -> QueueSnapshot:
+        # a published snapshot and its notifications are never modified. Writers do not copy the queue,
+        # the first reader of a new version does and later readers share it. That reader takes the lock,
+        # never call this with the lock held.
+        snapshot = self._snapshot
+        if snapshot.version == self._version:
+            return snapshot
+        with self._lock:
+            if self._snapshot.version != self._version:
+                self._snapshot = self._make_snapshot()
+            return self._snapshot
+
+    def _make_counts(self) -> QueueCounts:
+        return QueueCounts(self._version, len(self._mapping), len(self._by_urgency[Urgency.CRITICAL]))
+
+    def _make_snapshot(self) -> QueueSnapshot:
+        return QueueSnapshot(*self._make_counts(), tuple(self._mapping.values()))
+
+    def _changed(self) -> None:
+        self._counts = self._make_counts()
+        self.queue_changed.notify()
+
+    def _index(self, notification: Notification) -> None:
+        self._by_application.setdefault(notification.application, {})[notification.id] = None
+        self._application_urgencies.setdefault(notification.application, [0] * len(Urgency))[notification.urgency] += 1
+        self._newest[notification.application] = notification.id
+        self._by_urgency[notification.urgency][notification.id] = None
+        if notification.seen:
+            self._seen[notification.id] = None
+        self._by_content[content_key(notification)] = notification.id
+        self._search_index.add(notification)
+
+    def _unindex(self, notification: Notification) -> None:
+        ids = self._by_application.get(notification.application)
+        if ids is not None:
+            ids.pop(notification.id, None)
+            self._application_urgencies[notification.application][notification.urgency] -= 1
+            if not ids:
+                del self._by_application[notification.application]
+                del self._application_urgencies[notification.application]
+                del self._newest[notification.application]
+            elif self._newest[notification.application] == notification.id:
+                # ids are ordered by put, the last one is the newest
+                self._newest[notification.application] = list(ids)[-1]
+        self._by_urgency[notification.urgency].pop(notification.id, None)
+        self._seen.pop(notification.id, None)
+        key = content_key(notification)
+        if self._by_content.get(key) == notification.id:
+            del self._by_content[key]
+        self._search_index.remove(notification.id)
+
+    def _schedule(self, notification: Notification) -> None:
+        if notification.deadline and notification.application in ALLOWED_TO_EXPIRE:
+            heapq.heappush(self._deadlines, (notification.deadline, notification.id))
+            if len(self._deadlines) > 2 * len(self._mapping) + 64:
+                self._deadlines = [(d, nid) for d, nid in self._deadlines
+                                   if nid in self._mapping and self._mapping[nid].deadline == d]
+                heapq.heapify(self._deadlines)
+
+    def next_deadline(self) -> Optional[float]:
+        return self._deadlines[0][0] if self._deadlines else None
+
+    def _insert(self, notification: Notification) -> None:
+        replaced = self._mapping.get(notification.id)
+        if replaced is not None:
+            self._unindex(replaced)
+        self._mapping[notification.id] = notification
+        self._index(notification)
+
+    def _discard(self, nid: int) -> Notification:
+        notification = self._mapping.pop(nid)
+        self._unindex(notification)
+        return notification
+
+    @property
+    def epoch(self) -> str:
+        return self._epoch
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def _record(self, op: str, nid: int, notification: Optional[Notification] = None,
+                reason: CloseReason = CloseReason.DISMISSED) -> None:
+        self._version += 1
+        self._changes.append((self._version, op, nid, notification))
+        if self._journal is not None:
+            if op == 'remove':
+                self._journal.remove(nid, reason)
+            elif op == 'see':
+                self._journal.see(nid)
+            else:
+                self._journal.put(notification)
+
+    def changes(self, since: int) -> Optional[List[Tuple[int, str, int, Optional[Notification]]]]:
+        # None when the change log no longer reaches back to the requested version
+        if since > self._version:
+            return None
+        if since == self._version:
+            return []
+        if not self._changes or self._changes[0][0] > since + 1:
+            return None
+        return list(itertools.islice(self._changes, len(self._changes) - (self._version - since), None))
+
+    def count(self, urgency: Optional[Urgency] = None) -> int:
+        if urgency is None:
+            return len(self._mapping)
+        return len(self._by_urgency[urgency])
+
+    def ids_for(self, application: str) -> Collection[int]:
+        return tuple(self._by_application.get(application, ()))
+
+    def search(self, query: str, limit: Optional[int] = None) -> List[int]:
+        ids = self._search_index.search(query)
+        return ids if limit is None else ids[:limit]
+
+    def history(self, **filters) -> List[Mapping[str, any]]:
+        # closed notifications, newest first; storage keeps its own consistency, no lock needed
+        return [] if self._journal is None else self._journal.history(**filters)
+
+    def application_counts(self) -> Mapping[str, int]:
+        return {application: len(ids) for application, ids in self._by_application.items()}
+
+    def groups(self) -> List[ApplicationSummary]:
+        # one entry per application, in the order applications appeared
+        groups = []
+        for application, ids in self._by_application.items():
+            urgencies = self._application_urgencies[application]
+            urgency = max(urgency for urgency in Urgency if urgencies[urgency])
+            newest = self._mapping[self._newest[application]]
+            timestamp = newest.timestamp if isinstance(newest.timestamp, (int, float)) else None
+            groups.append(ApplicationSummary(application, len(ids), urgency, newest.summary, timestamp))
+        return groups
+
     def save(self, filename: str) -> None:
         try:
-            print('Saving notification queue to file')
+            logger.info('Saving notification queue to %s', filename)
             with open(filename, 'w') as f:
                 json.dump(list(self._mapping.values()), f, default=Notification.asdict)
         except:
-            warn('Failed to save notification queue')
+            logger.exception('Failed to save notification queue')
             if os.path.exists(filename):
                 os.unlink(filename)
 
+    def compact(self) -> None:
+        if self._journal is None:
+            return
+        with self._compaction_lock:
+            notifications = None
+            with self._lock:
+                if self._journal.records:
+                    # queued notifications are never modified in place, serializing them needs no lock
+                    notifications = tuple(self._mapping.values())
+                    self._journal.rotate()
+            if notifications is not None:
+                if self._journal.needs_snapshot:
+                    self._journal.write_snapshot([n.asdict() for n in notifications])
+                if self.blobs is not None:
+                    self.blobs.collect({digest for n in notifications for digest in blob_references(n.hints)})
+            # on every tick, retention also has to hold for a daemon that sat idle
+            self._journal.maintain()
+
+    def start_compaction(self, interval: float) -> threading.Thread:
+        def compact_forever():
+            while True:
+                time.sleep(interval)
+                self.compact()
+
+        thread = threading.Thread(target=compact_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def close(self) -> None:
+        if self._journal is not None:
+            self.compact()
+            self._journal.close()
+
+    def _see(self, nid: int) -> Optional[Notification]:
+        if nid not in self._mapping:
+            logger.debug('Unable to find notification %d', nid)
+            return None
+        logger.debug('Seeing: %d', nid)
+        previous = self._mapping[nid]
+        # copy on write, the previous revision may still be referenced by a snapshot
+        notification = copy.copy(previous)
+        notification.urgency = Urgency.NORMAL
+        notification.seen = True
+        self._mapping[nid] = notification
+        # the application index keeps its order, it is the age order eviction relies on
+        self._by_urgency[previous.urgency].pop(nid, None)
+        self._by_urgency[notification.urgency][nid] = None
+        self._application_urgencies[notification.application][previous.urgency] -= 1
+        self._application_urgencies[notification.application][notification.urgency] += 1
+        self._seen[nid] = None
+        self._record('see', nid)
+        return notification
+
     def see(self, nid: int) -> None:
-        if nid in self._mapping:
-            print(f'Seeing: {nid}')
-            notification = self._mapping[nid]
-            notification.urgency = Urgency.NORMAL
+        notification = self._see(nid)
+        if notification is not None:
             self.notification_seen.notify(notification)
-            return
-        warn(f'Unable to find notification {nid}')
+            self._changed()
 
-    def remove(self, nid: int) -> None:
-        if nid in self._mapping:
-            print(f'Removing: {nid}')
-            del self._mapping[nid]
-            return
-        warn(f'Unable to find notification {nid}')
+    def see_all(self, nids: Iterable[int]) -> List[int]:
+        # marks only, activating every notification of a batch is never what the user wants
+        seen = [nid for nid in nids if self._see(nid) is not None]
+        if seen:
+            self._changed()
+        return seen
+
+    def _remove(self, nid: int, reason: CloseReason) -> Optional[Notification]:
+        if nid not in self._mapping:
+            logger.debug('Unable to find notification %d', nid)
+            return None
+        logger.debug('Removing: %d', nid)
+        notification = self._discard(nid)
+        self._record('remove', nid, reason=reason)
+        return notification
+
+    def remove(self, nid: int, reason: CloseReason = CloseReason.DISMISSED) -> None:
+        self.remove_all((nid,), reason)
+
+    def select(self, application: Optional[str] = None, urgency: Optional[Urgency] = None,
+               since: Optional[float] = None, until: Optional[float] = None,
+               min_id: Optional[int] = None, max_id: Optional[int] = None,
+               offset: int = 0, limit: Optional[int] = None) -> List[Notification]:
+        # start from the narrowest index that applies, ids ascend in queue order
+        if application is not None:
+            candidates = (self._mapping[nid] for nid in sorted(self._by_application.get(application, ())))
+        elif urgency is not None:
+            candidates = (self._mapping[nid] for nid in sorted(self._by_urgency[urgency]))
+        else:
+            candidates = iter(self._mapping.values())
 
-    def remove_all(self, nids: Iterable[int]) -> None:
-        for nid in nids:
-            self.remove(nid)
+        def accept(notification: Notification) -> bool:
+            if urgency is not None and notification.urgency != urgency:
+                return False
+            if (min_id is not None and notification.id < min_id) or (max_id is not None and notification.id > max_id):
+                return False
+            if since is None and until is None:
+                return True
+            if not isinstance(notification.timestamp, (int, float)):
+                return False
+            return (since is None or notification.timestamp >= since) \
+                and (until is None or notification.timestamp < until)
+
+        stop = None if limit is None else offset + limit
+        return list(itertools.islice(filter(accept, candidates), offset, stop))
+
+    def remove_all(self, nids: Iterable[int], reason: CloseReason = CloseReason.DISMISSED) -> List[int]:
+        # a single change and close notification for the whole batch
+        removed = [n for n in map(lambda nid: self._remove(nid, reason), nids) if n is not None]
+        if removed:
+            self.notifications_closed.notify(removed, reason)
+            self._changed()
+        return [n.id for n in removed]
+
+    def see_where(self, **filters) -> List[int]:
+        return self.see_all([n.id for n in self.select(**filters)])
+
+    def remove_where(self, reason: CloseReason = CloseReason.DISMISSED, **filters) -> List[int]:
+        return self.remove_all([n.id for n in self.select(**filters)], reason)
 
     def put(self, notification: Notification) -> None:
+        self.received.mark()
         to_replace: Optional[int]
         if notification.application in SINGLE_NOTIFICATION_APPS:
             # replace notification for applications that only allow one
-            to_replace = next((ntf.id for ntf in self._mapping.values()
-                               if ntf.application == notification.application), None)
+            to_replace = next(iter(self._by_application.get(notification.application, ())), None)
         else:
             # cannot have two notifications with the same ID
             to_replace = notification.id if notification.id in self._mapping else None
 
+        if not to_replace and self._coalesce_window:
+            to_replace = self._coalesce(notification)
+
         if to_replace:
             notification.id = to_replace
-            print(f'Replacing: {notification.id}')
-            self._mapping[notification.id] = notification
-            return
+            logger.debug('Replacing: %d', notification.id)
+        else:
+            notification.id = self._last_id
+            self._last_id += 1
+            logger.debug('Adding: %d', notification.id)
+        self._insert(notification)
+        self._schedule(notification)
+        self._record('replace' if to_replace else 'add', notification.id, notification)
+        self._evict(notification)
+        self._changed()
 
-        notification.id = self._last_id
-        self._last_id += 1
-        print(f'Adding: {notification.id}')
-        self._mapping[notification.id] = notification
+    def _victim(self, candidates: Collection[int], keep: int) -> int:
+        if self._eviction == EvictionPolicy.LOWEST_URGENCY:
+            for urgency in Urgency:
+                ids = self._by_urgency[urgency]
+                # the smaller collection drives the intersection
+                if len(ids) <= len(candidates):
+                    victim = next((nid for nid in ids if nid != keep and nid in candidates), None)
+                else:
+                    victim = next((nid for nid in candidates if nid != keep and nid in ids), None)
+                if victim is not None:
+                    return victim
+        elif self._eviction == EvictionPolicy.SEEN:
+            if len(self._seen) <= len(candidates):
+                victim = next((nid for nid in self._seen if nid != keep and nid in candidates), None)
+            else:
+                victim = next((nid for nid in candidates if nid != keep and nid in self._seen), None)
+            if victim is not None:
+                return victim
+        # oldest first, and the fallback of the other policies
+        return next(nid for nid in candidates if nid != keep)
+
+    def _evict(self, notification: Notification) -> None:
+        victims = []
+        ids = self._by_application.get(notification.application, {})
+        while self._application_quota and len(ids) > self._application_quota:
+            victims.append(self._evict_one(ids, notification.id))
+        while self._capacity and len(self._mapping) > self._capacity:
+            victims.append(self._evict_one(self._mapping, notification.id))
+        if victims:
+            logger.info('Evicted: %s', [n.id for n in victims])
+            self.notifications_closed.notify(victims, CloseReason.EXPIRED)
+
+    def _evict_one(self, candidates: Collection[int], keep: int) -> Notification:
+        nid = self._victim(candidates, keep)
+        self.evictions += 1
+        return self._remove(nid, CloseReason.EXPIRED)
+
+    def _coalesce(self, notification: Notification) -> Optional[int]:
+        nid = self._by_content.get(content_key(notification))
+        if nid is None:
+            return None
+        previous = self._mapping[nid]
+        if not isinstance(previous.timestamp, (int, float)) or not isinstance(notification.timestamp, (int, float)) \
+                or notification.timestamp - previous.timestamp > self._coalesce_window:
+            return None
+        logger.debug('Coalescing into: %d', nid)
+        # the duplicate takes over the entry, keeping count of how often it was sent
+        notification.occurrences = previous.occurrences + 1
+        notification.urgency = max(notification.urgency, previous.urgency)
+        return nid
 
     def cleanup(self) -> None:
         now = time.time()
-        to_remove = [ntf.id for ntf in self._mapping.values()
-                     if ntf.deadline and ntf.deadline < now
-                     and ntf.application in ALLOWED_TO_EXPIRE]
+        to_remove: MutableMapping[int, None] = {}
+        while self._deadlines and self._deadlines[0][0] < now:
+            deadline, nid = heapq.heappop(self._deadlines)
+            notification = self._mapping.get(nid)
+            if notification is not None and notification.deadline == deadline \
+                    and notification.application in ALLOWED_TO_EXPIRE:
+                to_remove[nid] = None
         if to_remove:
-            print(f'Expired: {to_remove}')
-            for nid in to_remove:
-                self.notification_closed.notify(self._mapping[nid], CloseReason.EXPIRED)
-                del self._mapping[nid]
+            logger.debug('Expired: %s', list(to_remove))
+            self.expirations += len(to_remove)
+            self.remove_all(to_remove, CloseReason.EXPIRED)
 
     @classmethod
-    def load(cls, filename: str) -> 'NotificationQueue':
-        if not os.path.exists(filename):
-            print('Creating empty notification queue')
-            return cls({})
-
-        try:
-            print('Loading notification queue from file')
-            with open(filename, 'r') as f:
-                mapping = {n.id: n for n in json.load(f, object_hook=Notification.make)}
-        except:
-            warn('Failed to load notification queue')
-            mapping = {}
-
-        return cls(mapping)
+    def load(cls, filename: str, journal: Optional[NotificationJournal] = None, **kwargs) -> 'NotificationQueue':
+        # filename locates the default journal and the blob store, a given journal replaces the former
+        journal = NotificationJournal(filename) if journal is None else journal
+        mapping = journal.replay()
+        if not mapping:
+            logger.info('Creating empty notification queue')
+        journal.open()
+        blobs = BlobStore(os.path.join(os.path.dirname(filename), 'blobs'))
+        return cls(mapping, journal, blobs, **kwargs)
@@ -0,0 +1,58 @@
+import re
+import threading
+from datetime import datetime
+from typing import MutableMapping
+from weakref import WeakKeyDictionary
+
+from ._notification import Notification, ApplicationSummary
+
+HTML_TAGS_PATTERN = re.compile(r'<[^>]*?>')
+
+# same replacements as GLib.markup_escape_text(), without pulling in GLib
+MARKUP_ESCAPE_PATTERN = re.compile('[&<>\'"\x01-\x08\x0b\x0c\x0e-\x1f\x7f-\x84\x86-\x9f]')
+MARKUP_ESCAPES = {'&': '&amp;', '<': '&lt;', '>': '&gt;', "'": '&apos;', '"': '&quot;'}
+
+
+def markup_escape_text(value: str) -> str:
+    return MARKUP_ESCAPE_PATTERN.sub(
+        lambda match: MARKUP_ESCAPES.get(match.group(), f'&#x{ord(match.group()):x};'), value)
+
+
+def strip_tags(value: str) -> str:
+    return markup_escape_text(HTML_TAGS_PATTERN.sub('', value))
+
+
+def rofi_entry(notification: Notification, tsformat: str) -> str:
+    stripped_summ = strip_tags(notification.summary)
+    stripped_app = strip_tags(notification.application)
+    stripped_body = strip_tags(' '.join(notification.body.split()))
+    formatted_ts = f"{datetime.fromtimestamp(notification.timestamp).strftime(tsformat)} " if tsformat else ""
+    repeated = f' <small>×{notification.occurrences}</small>' if notification.occurrences > 1 else ''
+    return f'<b>{formatted_ts}{stripped_summ}</b>{repeated} <small>({stripped_app})</small>\n<small>{stripped_body}</small>'
+
+
+def rofi_group_entry(group: ApplicationSummary, tsformat: str) -> str:
+    stripped_app = strip_tags(group.application)
+    stripped_summ = strip_tags(group.summary)
+    formatted_ts = f"{datetime.fromtimestamp(group.timestamp).strftime(tsformat)} " \
+        if tsformat and group.timestamp is not None else ""
+    return f'<b>{stripped_app}</b> <small>×{group.count}</small>\n<small>{formatted_ts}{stripped_summ}</small>'
+
+
+class RenderCache:
+    def __init__(self) -> None:
+        # notifications are replaced rather than edited when their text changes, so the
+        # object itself identifies a revision and entries go away together with it
+        self._lock = threading.Lock()
+        self._entries: MutableMapping[str, MutableMapping[Notification, str]] = {}
+
+    def entry(self, notification: Notification, tsformat: str) -> str:
+        with self._lock:
+            entries = self._entries.setdefault(tsformat, WeakKeyDictionary())
+            entry = entries.get(notification)
+        if entry is None:
+            entry = rofi_entry(notification, tsformat)
+            with self._lock:
+                entries[notification] = entry
+        return entry
+
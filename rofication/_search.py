@@ -0,0 +1,60 @@
+import math
+import re
+from typing import List, Mapping, MutableMapping, Optional, Tuple
+
+from ._notification import Notification
+from ._render import HTML_TAGS_PATTERN
+
+TOKEN_PATTERN = re.compile(r'\w+')
+# a hit in the summary counts more than one in the body or the application name
+FIELD_WEIGHTS = (('summary', 3), ('application', 2), ('body', 1))
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    if not text:
+        return []
+    return TOKEN_PATTERN.findall(HTML_TAGS_PATTERN.sub(' ', text).casefold())
+
+
+class SearchIndex:
+    def __init__(self) -> None:
+        # token -> {id: weight}, the weight sums the field weights of every occurrence
+        self._postings: MutableMapping[str, MutableMapping[int, int]] = {}
+        # id -> tokens it was indexed under, needed to take it out again
+        self._documents: MutableMapping[int, Tuple[str, ...]] = {}
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def add(self, notification: Notification) -> None:
+        self.remove(notification.id)
+        weights: MutableMapping[str, int] = {}
+        for field, weight in FIELD_WEIGHTS:
+            for token in tokenize(getattr(notification, field)):
+                weights[token] = weights.get(token, 0) + weight
+        for token, weight in weights.items():
+            self._postings.setdefault(token, {})[notification.id] = weight
+        self._documents[notification.id] = tuple(weights)
+
+    def remove(self, nid: int) -> None:
+        for token in self._documents.pop(nid, ()):
+            postings = self._postings[token]
+            del postings[nid]
+            if not postings:
+                del self._postings[token]
+
+    def search(self, query: str) -> List[int]:
+        # every token has to match, the rarest one drives the intersection
+        tokens = set(tokenize(query))
+        if not tokens:
+            return []
+        postings: List[Mapping[int, int]] = sorted((self._postings.get(token, {}) for token in tokens), key=len)
+        if not postings[0]:
+            return []
+        scores: MutableMapping[int, float] = {}
+        for nid in postings[0]:
+            if all(nid in p for p in postings[1:]):
+                # weighted by inverse document frequency, rare tokens say more
+                scores[nid] = sum(p[nid] * math.log(1 + len(self._documents) / len(p)) for p in postings)
+        # best match first, newer notifications win ties
+        return sorted(scores, key=lambda nid: (-scores[nid], -nid))
@@ -1,15 +1,59 @@
+import base64
+import io
 import json
+import logging
 import os
 import threading
+import time
 from socketserver import ThreadingMixIn, UnixStreamServer, BaseRequestHandler
-from typing import TextIO
+from typing import TextIO, Mapping, Sequence, MutableMapping
+from urllib.parse import parse_qsl
 
+from ._metrics import Histogram
 from ._notification import Urgency, Notification
 from ._queue import NotificationQueue
+from ._render import RenderCache
 from ._static import ROFICATION_UNIX_SOCK
 
+COMMANDS = ('blob', 'num', 'del', 'delm', 'dela', 'delq', 'list', 'stream', 'render', 'renderq', 'groups', 'since', 'see', 'seeq', 'search', 'history', 'stats')
+
+logger = logging.getLogger(__name__)
+
+
+def command_histograms() -> MutableMapping[str, Histogram]:
+    # one latency histogram per command, created up front so that threads only ever read the mapping
+    return {command: Histogram() for command in COMMANDS}
+
+
+def parse_filter(query: str) -> Mapping[str, any]:
+    # 'app=<application>&urgency=<0-2>&since=<ts>&until=<ts>&age=<seconds>&min_id=<id>&max_id=<id>
+    #  &offset=<n>&limit=<n>'
+    filters = {}
+    # every upper bound applies, whatever order until and age come in
+    untils = []
+    for key, value in parse_qsl(query):
+        if key == 'app':
+            filters['application'] = value
+        elif key == 'urgency':
+            filters['urgency'] = Urgency(int(value))
+        elif key == 'since':
+            filters[key] = float(value)
+        elif key == 'until':
+            untils.append(float(value))
+        elif key == 'age':
+            # older than the given number of seconds
+            untils.append(time.time() - float(value))
+        elif key in ('min_id', 'max_id', 'offset', 'limit'):
+            filters[key] = int(value)
+    if untils:
+        filters['until'] = min(untils)
+    return filters
+
 
 class ThreadedUnixStreamServer(ThreadingMixIn, UnixStreamServer):
+    # server_close() must not join handlers, a watch subscriber stays connected until the daemon exits
+    daemon_threads = True
+
     def start(self) -> threading.Thread:
         thread = threading.Thread(target=self.serve_forever)
         thread.setDaemon(True)
@@ -17,15 +61,22 @@ class ThreadedUnixStreamServer(ThreadingMixIn, UnixStreamServer):
         return thread
 
 
-class RoficationRequestHandler(BaseRequestHandler):
+class RoficationCommands:
+    # transport independent command implementations, self.server provides queue, render_cache
+    # and command_latency
+    def blob(self, fp: TextIO, digest: str) -> None:
+        if self.server.queue.blobs is None:
+            return
+        try:
+            data = self.server.queue.blobs.get(digest)
+        except (OSError, ValueError):
+            return
+        fp.write(base64.b64encode(data).decode('ascii'))
+
     def count(self, fp: TextIO) -> None:
-        with self.server.queue.lock:
-            crit = 0
-            for n in self.server.queue:
-                if n.urgency == Urgency.CRITICAL:
-                    crit += 1
-            fp.write(f'{len(self.server.queue)},{crit}')
-            fp.flush()
+        counts = self.server.queue.counts
+        fp.write(f'{counts.count},{counts.critical}')
+        fp.flush()
 
     def delete(self, nid: int) -> None:
         with self.server.queue.lock:
@@ -38,42 +89,218 @@ class RoficationRequestHandler(BaseRequestHandler):
 
     def delete_all(self, application: str) -> None:
         with self.server.queue.lock:
-            to_remove = [n.id for n in self.server.queue
-                         if n.application == application]
-            self.server.queue.remove_all(to_remove)
+            self.server.queue.remove_all(self.server.queue.ids_for(application))
+
+    def delete_matching(self, fp: TextIO, query: str) -> None:
+        filters = parse_filter(query)
+        with self.server.queue.lock:
+            removed = self.server.queue.remove_where(**filters)
+        fp.write(str(len(removed)))
+
+    def see_matching(self, fp: TextIO, query: str) -> None:
+        filters = parse_filter(query)
+        with self.server.queue.lock:
+            seen = self.server.queue.see_where(**filters)
+        fp.write(str(len(seen)))
 
-    def list(self, fp: TextIO) -> None:
+    def select(self, query: str) -> Sequence[Notification]:
+        filters = parse_filter(query)
+        if not filters:
+            # the common unfiltered listing never waits for writers
+            return self.server.queue.snapshot.notifications
+        # filtered queries only hold the lock to walk the indexes, serialization happens afterwards
         with self.server.queue.lock:
-            json.dump(list(self.server.queue), fp, default=Notification.asdict)
+            return self.server.queue.select(**filters)
+
+    def list(self, fp: TextIO, query: str) -> None:
+        json.dump(self.select(query), fp, default=Notification.asdict)
+
+    def stream(self, fp: TextIO, query: str) -> None:
+        for notification in self.select(query):
+            fp.write(json.dumps(notification, default=Notification.asdict))
+            fp.write('\n')
+
+    def groups(self, fp: TextIO) -> None:
+        with self.server.queue.lock:
+            groups = self.server.queue.groups()
+        json.dump([group._asdict() for group in groups], fp)
+
+    def render(self, fp: TextIO, tsformat: str, query: str = '') -> None:
+        notifications = self.select(query)
+        header = {'ids': [], 'applications': [], 'urgent': [], 'low': []}
+        for index, notification in enumerate(notifications):
+            header['ids'].append(notification.id)
+            header['applications'].append(notification.application)
+            if notification.urgency == Urgency.CRITICAL:
+                header['urgent'].append(index)
+            if notification.urgency == Urgency.LOW:
+                header['low'].append(index)
+        fp.write(json.dumps(header))
+        fp.write('\n')
+        for notification in notifications:
+            fp.write(self.server.render_cache.entry(notification, tsformat))
+            fp.write('\0')
+
+    def since(self, fp: TextIO, version: int) -> None:
+        with self.server.queue.lock:
+            response = {'epoch': self.server.queue.epoch, 'version': self.server.queue.version}
+            changes = self.server.queue.changes(version)
+            if changes is None:
+                notifications = list(self.server.queue)
+        if changes is None:
+            response['resync'] = True
+            response['notifications'] = notifications
+        else:
+            response['changes'] = [{'op': op, 'id': nid, 'notification': notification} if notification
+                                   else {'op': op, 'id': nid}
+                                   for _, op, nid, notification in changes]
+        json.dump(response, fp, default=Notification.asdict)
 
     def see(self, nid: int) -> None:
         with self.server.queue.lock:
             self.server.queue.see(nid)
 
-    def handle(self) -> None:
+    def history(self, fp: TextIO, query: str) -> None:
+        json.dump(self.server.queue.history(**parse_filter(query)), fp)
+
+    def search(self, fp: TextIO, query: str) -> None:
         with self.server.queue.lock:
-            self.server.queue.cleanup()
-
-        with self.request.makefile(mode='rw', encoding='utf-8') as fp:
-            cmd, *args = fp.readline().strip().split(':')
-            if cmd == 'num':
-                # get number of notifications
-                self.count(fp)
-            elif cmd == 'del':
-                # dismiss an item.
-                self.delete(nid=int(args[0]))
-            elif cmd == 'delm':
-                # dismiss list of notifications.
-                self.delete_multi(ids=args[0])
-            elif cmd == 'dela':
-                # dismiss all items from an application.
-                self.delete_all(application=args[0])
-            elif cmd == 'list':
-                # getting a listing.
-                self.list(fp)
-            elif cmd == 'see':
-                # see an item, set the urgency to normal and activate
-                self.see(nid=int(args[0]))
+            ids = self.server.queue.search(query)
+        json.dump(ids, fp)
+
+    def stats(self, fp: TextIO) -> None:
+        queue = self.server.queue
+        with queue.lock:
+            counts = queue.counts
+            applications = queue.application_counts()
+        json.dump({
+            'queue': {'size': counts.count, 'critical': counts.critical, 'applications': applications},
+            'notify': {'total': queue.received.total, 'rate': queue.received.rate()},
+            'expirations': queue.expirations,
+            'evictions': queue.evictions,
+            'dispatchers': {name: dispatcher.stats() for name, dispatcher in queue.dispatchers.items()},
+            'lock': {'wait': queue.lock.wait.asdict(), 'hold': queue.lock.hold.asdict()},
+            'commands': {command: histogram.asdict() for command, histogram in self.server.command_latency.items()},
+        }, fp)
+
+    def dispatch(self, line: str, fp: TextIO) -> None:
+        cmd, _, arg = line.strip().partition(':')
+        start = time.perf_counter()
+        try:
+            self._dispatch(cmd, arg, fp)
+        except ValueError:
+            # arguments are parsed before anything is written, a malformed one gets an empty response
+            # and a session carries on with the next command
+            logger.warning('Ignoring malformed command %r', line.strip())
+            return
+        histogram = self.server.command_latency.get(cmd)
+        if histogram is not None:
+            histogram.observe(time.perf_counter() - start)
+
+    def _dispatch(self, cmd: str, arg: str, fp: TextIO) -> None:
+        if cmd == 'blob':
+            # base64 content of a binary hint moved out of the queue, empty if unknown.
+            self.blob(fp, digest=arg)
+        elif cmd == 'num':
+            # get number of notifications
+            self.count(fp)
+        elif cmd == 'del':
+            # dismiss an item.
+            self.delete(nid=int(arg))
+        elif cmd == 'delm':
+            # dismiss list of notifications.
+            self.delete_multi(ids=arg)
+        elif cmd == 'dela':
+            # dismiss all items from an application.
+            self.delete_all(application=arg)
+        elif cmd == 'delq':
+            # dismiss everything matching a filter, answers with the number dismissed.
+            self.delete_matching(fp, query=arg)
+        elif cmd == 'list':
+            # getting a listing, optionally filtered and paged.
+            self.list(fp, query=arg)
+        elif cmd == 'stream':
+            # same as list, one JSON object per line.
+            self.stream(fp, query=arg)
+        elif cmd == 'render':
+            # rofi rows, a JSON header line followed by NUL separated entries.
+            self.render(fp, tsformat=arg)
+        elif cmd == 'renderq':
+            # same as render for the notifications matching a filter, 'ts' holds the timestamp format.
+            self.render(fp, tsformat=dict(parse_qsl(arg)).get('ts', ''), query=arg)
+        elif cmd == 'groups':
+            # one JSON object per application with its count, highest urgency and newest summary.
+            self.groups(fp)
+        elif cmd == 'since':
+            # changes after a version, or everything when the client has to resync.
+            self.since(fp, version=int(arg))
+        elif cmd == 'see':
+            # see an item, set the urgency to normal and activate
+            self.see(nid=int(arg))
+        elif cmd == 'seeq':
+            # mark everything matching a filter as seen without activating it, answers with the number seen.
+            self.see_matching(fp, query=arg)
+        elif cmd == 'history':
+            # closed notifications, newest first, paged with the list filter.
+            self.history(fp, query=arg)
+        elif cmd == 'search':
+            # ids matching every word of the query, best match first.
+            self.search(fp, query=arg)
+        elif cmd == 'stats':
+            # queue size, counters and latency histograms as JSON.
+            self.stats(fp)
+
+
+class RoficationRequestHandler(RoficationCommands, BaseRequestHandler):
+    def watch(self) -> None:
+        changed = threading.Event()
+
+        def queue_changed():
+            changed.set()
+
+        self.server.queue.queue_changed += queue_changed
+        try:
+            last = None
+            while True:
+                counts = self.server.queue.counts
+                current = (counts.count, counts.critical)
+                if current != last:
+                    # unbuffered, a vanished subscriber must not leave data behind in a file buffer
+                    self.request.sendall('{},{}\n'.format(*current).encode('utf-8'))
+                    last = current
+                changed.wait()
+                changed.clear()
+        except (BrokenPipeError, ConnectionResetError):
+            # subscriber went away
+            pass
+        finally:
+            self.server.queue.queue_changed -= queue_changed
+
+    def session(self, rfile: TextIO, wfile: TextIO) -> None:
+        # every command gets a response framed as '<length in characters>\n<payload>'
+        for line in rfile:
+            out = io.StringIO()
+            self.dispatch(line, out)
+            payload = out.getvalue()
+            wfile.write(f'{len(payload)}\n{payload}')
+            wfile.flush()
+
+    def handle(self) -> None:
+        try:
+            # reader and writer are separate so that pipelined commands stay buffered
+            with self.request.makefile(mode='r', encoding='utf-8', newline='') as rfile, \
+                    self.request.makefile(mode='w', encoding='utf-8', newline='') as wfile:
+                line = rfile.readline()
+                if line.strip() == 'session':
+                    self.session(rfile, wfile)
+                elif line.strip() == 'watch':
+                    # stream '<count>,<critical count>' lines whenever the queue changes
+                    self.watch()
+                else:
+                    self.dispatch(line, wfile)
+        except (BrokenPipeError, ConnectionResetError):
+            # the client stopped reading, e.g. rofi closed before all rows were streamed
+            pass
 
 
 class RoficationServer(ThreadedUnixStreamServer):
@@ -83,6 +310,8 @@ class RoficationServer(ThreadedUnixStreamServer):
             os.remove(server_address)
         super().__init__(server_address, RoficationRequestHandler)
         self.queue: NotificationQueue = queue
+        self.render_cache: RenderCache = RenderCache()
+        self.command_latency: MutableMapping[str, Histogram] = command_histograms()
 
     def __exit__(self, *args) -> None:
         super().__exit__(*args)
@@ -0,0 +1,183 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import MutableMapping, Optional, Mapping, List, Tuple
+
+from ._notification import Notification, Urgency, CloseReason
+
+# rows returned by a history query without an explicit limit
+HISTORY_PAGE_SIZE = 100
+
+# urgency and seen live in their own columns so that seeing a notification does not rewrite its data
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS notifications (
+    id INTEGER PRIMARY KEY,
+    application TEXT,
+    urgency INTEGER NOT NULL,
+    timestamp REAL,
+    seen INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS archive (
+    id INTEGER NOT NULL,
+    application TEXT,
+    urgency INTEGER NOT NULL,
+    timestamp REAL,
+    seen INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    closed REAL NOT NULL,
+    reason INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS archive_application ON archive (application, timestamp);
+CREATE INDEX IF NOT EXISTS archive_urgency ON archive (urgency, timestamp);
+CREATE INDEX IF NOT EXISTS archive_timestamp ON archive (timestamp);
+CREATE INDEX IF NOT EXISTS archive_closed ON archive (closed);
+CREATE INDEX IF NOT EXISTS archive_id ON archive (id);
+'''
+
+logger = logging.getLogger(__name__)
+
+
+def _timestamp(notification: Notification) -> Optional[float]:
+    # notifications loaded from old queue files may carry an empty timestamp
+    return notification.timestamp if isinstance(notification.timestamp, (int, float)) else None
+
+
+class SqliteStorage:
+    # same interface as NotificationJournal, plus an archive of closed notifications. Every change is
+    # already in the database, compaction does not have to serialize the queue
+    needs_snapshot: bool = False
+
+    def __init__(self, filename: str, max_age: Optional[float] = None, max_entries: Optional[int] = None) -> None:
+        self._filename: str = filename
+        self._max_age: Optional[float] = max_age
+        self._max_entries: Optional[int] = max_entries
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._records: int = 0
+
+    @property
+    def records(self) -> int:
+        return self._records
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self._filename, check_same_thread=False)
+        # readers see the last commit and never block the writer
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        return db
+
+    def replay(self) -> MutableMapping[int, Notification]:
+        self.open()
+        logger.info('Loading notification queue from %s', self._filename)
+        with self._lock:
+            rows = self._db.execute('SELECT data, urgency, seen FROM notifications ORDER BY id').fetchall()
+        mapping: MutableMapping[int, Notification] = {}
+        for data, urgency, seen in rows:
+            notification = Notification.make(json.loads(data))
+            notification.urgency = Urgency(urgency)
+            notification.seen = bool(seen)
+            mapping[notification.id] = notification
+        return mapping
+
+    def open(self) -> None:
+        if self._db is None:
+            self._db = self._connect()
+            self._db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        if self._db is not None:
+            with self._lock:
+                self._db.close()
+                self._db = None
+
+    def _write(self, *statements: Tuple[str, tuple]) -> None:
+        if self._db is None:
+            return
+        try:
+            with self._lock, self._db:
+                for sql, parameters in statements:
+                    self._db.execute(sql, parameters)
+        except sqlite3.Error:
+            logger.exception('Failed to write to notification storage')
+
+    def put(self, notification: Notification) -> None:
+        self._write(('INSERT OR REPLACE INTO notifications (id, application, urgency, timestamp, seen, data) '
+                     'VALUES (?, ?, ?, ?, ?, ?)',
+                     (notification.id, notification.application, int(notification.urgency),
+                      _timestamp(notification), int(notification.seen), json.dumps(notification.asdict()))))
+        self._records += 1
+
+    def remove(self, nid: int, reason: CloseReason) -> None:
+        # moves the row, the daemon does not have to hand the notification back
+        self._write(('INSERT INTO archive (id, application, urgency, timestamp, seen, data, closed, reason) '
+                     'SELECT id, application, urgency, timestamp, seen, data, ?, ? FROM notifications WHERE id = ?',
+                     (time.time(), int(reason), nid)),
+                    ('DELETE FROM notifications WHERE id = ?', (nid,)))
+        self._records += 1
+
+    def see(self, nid: int) -> None:
+        self._write(('UPDATE notifications SET urgency = ?, seen = 1 WHERE id = ?', (int(Urgency.NORMAL), nid)))
+        self._records += 1
+
+    def rotate(self) -> None:
+        # every change is already in the database, there is no journal to set aside
+        self._records = 0
+
+    def maintain(self) -> None:
+        # runs on the compaction thread on every tick, whether or not anything changed
+        self.prune()
+        if self._db is None:
+            return
+        try:
+            with self._lock:
+                self._db.execute('PRAGMA wal_checkpoint(PASSIVE)')
+        except sqlite3.Error:
+            logger.exception('Failed to checkpoint notification storage')
+
+    def prune(self) -> None:
+        statements = []
+        if self._max_age:
+            statements.append(('DELETE FROM archive WHERE closed < ?', (time.time() - self._max_age,)))
+        if self._max_entries:
+            statements.append(('DELETE FROM archive WHERE rowid IN '
+                               '(SELECT rowid FROM archive ORDER BY rowid DESC LIMIT -1 OFFSET ?)',
+                               (self._max_entries,)))
+        if statements:
+            self._write(*statements)
+
+    def history(self, application: Optional[str] = None, urgency: Optional[Urgency] = None,
+                since: Optional[float] = None, until: Optional[float] = None,
+                min_id: Optional[int] = None, max_id: Optional[int] = None,
+                offset: int = 0, limit: Optional[int] = None) -> List[Mapping[str, any]]:
+        clauses, parameters = [], []
+        if application is not None:
+            clauses.append('application = ?')
+            parameters.append(application)
+        if urgency is not None:
+            clauses.append('urgency = ?')
+            parameters.append(int(urgency))
+        if since is not None:
+            clauses.append('timestamp >= ?')
+            parameters.append(since)
+        if until is not None:
+            clauses.append('timestamp < ?')
+            parameters.append(until)
+        if min_id is not None:
+            clauses.append('id >= ?')
+            parameters.append(min_id)
+        if max_id is not None:
+            clauses.append('id <= ?')
+            parameters.append(max_id)
+        where = f' WHERE {" AND ".join(clauses)}' if clauses else ''
+        parameters += [HISTORY_PAGE_SIZE if limit is None else limit, offset]
+        # a connection of its own, pages are read without holding up writers
+        with closing(self._connect()) as db:
+            rows = db.execute(f'SELECT data, urgency, seen, closed, reason FROM archive{where} '
+                              'ORDER BY timestamp DESC, rowid DESC LIMIT ? OFFSET ?', parameters).fetchall()
+        return [{'closed': closed, 'reason': reason,
+                 'notification': {**json.loads(data), 'urgency': urgency, 'seen': bool(seen)}}
+                for data, urgency, seen, closed, reason in rows]
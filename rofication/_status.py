@@ -0,0 +1,107 @@
+import mmap
+import os
+from typing import Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from ._queue import NotificationQueue
+
+# '<sequence> <count> <critical count> <daemon pid> <sequence>\n', space padded to a fixed width so that the
+# record is always rewritten in place and shell scripts can split it with read
+STATUS_FORMAT = '{:>20} {:>10} {:>10} {:>10} {:>20}\n'
+STATUS_SIZE = len(STATUS_FORMAT.format(0, 0, 0, 0, 0))
+SEQUENCE_WIDTH = 20
+# offset of the trailing sequence, it is followed by the newline
+TAIL_OFFSET = STATUS_SIZE - SEQUENCE_WIDTH - 1
+# attempts to get a record that is not in the middle of being written
+READ_RETRIES = 10
+
+
+def status_path(unix_socket: str) -> str:
+    return unix_socket + '.status'
+
+
+def read_status(filename: str) -> Optional[Tuple[int, int]]:
+    # (count, critical count), None when there is no consistent record of a running daemon
+    for _ in range(READ_RETRIES):
+        try:
+            with open(filename, 'rb') as fp:
+                # a single read, front to back as the writer expects
+                data = fp.read(STATUS_SIZE)
+        except OSError:
+            return None
+        try:
+            head, count, critical, pid, tail = (int(field) for field in data.split())
+        except ValueError:
+            continue
+        # seqlock: two different copies or an odd sequence mean a write was in progress
+        if head != tail or head % 2:
+            continue
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            # left behind by a daemon that did not exit cleanly
+            return None
+        except PermissionError:
+            pass
+        return count, critical
+    return None
+
+
+class StatusFile:
+    def __init__(self, filename: str) -> None:
+        self._filename: str = filename
+        self._map: Optional[mmap.mmap] = None
+        self._sequence: int = 0
+
+    def open(self) -> None:
+        # a fresh file, never one somebody else put in place
+        if os.path.lexists(self._filename):
+            os.remove(self._filename)
+        fd = os.open(self._filename, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            os.ftruncate(fd, STATUS_SIZE)
+            self._map = mmap.mmap(fd, STATUS_SIZE)
+        finally:
+            os.close(fd)
+        self.publish(0, 0)
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+            try:
+                os.remove(self._filename)
+            except FileNotFoundError:
+                pass
+
+    def __enter__(self) -> 'StatusFile':
+        self.open()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def publish(self, count: int, critical: int) -> None:
+        # writers are serialized by the caller, readers never wait for them
+        if self._map is None:
+            return
+        # readers go front to back, so the copies are written the other way round: an odd trailing copy
+        # first, the leading copy last. A reader that saw the old leading copy then always finds a
+        # different trailing one once the body started to change.
+        self._sequence += 1
+        self._map[TAIL_OFFSET:TAIL_OFFSET + SEQUENCE_WIDTH] = f'{self._sequence:>{SEQUENCE_WIDTH}}'.encode('ascii')
+        self._sequence += 1
+        record = STATUS_FORMAT.format(self._sequence, count, critical, os.getpid(), self._sequence).encode('ascii')
+        self._map[SEQUENCE_WIDTH:TAIL_OFFSET] = record[SEQUENCE_WIDTH:TAIL_OFFSET]
+        self._map[:SEQUENCE_WIDTH] = record[:SEQUENCE_WIDTH]
+        self._map[TAIL_OFFSET:] = record[TAIL_OFFSET:]
+
+    def follow(self, queue: 'NotificationQueue') -> None:
+        # queue_changed fires with the queue lock held, which keeps publish single writer
+        def queue_changed():
+            counts = queue.counts
+            self.publish(counts.count, counts.critical)
+
+        queue.queue_changed += queue_changed
+        with queue.lock:
+            queue_changed()
@@ -1,19 +1,228 @@
+import json
+import logging
 import os
+import re
+import threading
+import time
 from collections.abc import MutableSequence, Callable
-from subprocess import check_output
-from typing import Optional
+from subprocess import check_output, CalledProcessError
+from typing import Optional, Mapping, MutableMapping, Sequence, Tuple, Pattern, List
+
+XRESOURCES_CACHE = os.path.expanduser('~/.cache/rofication/xresources.json')
+# files the X resource database is usually loaded from, touching one of them invalidates the cache
+XRESOURCES_SOURCES = ('~/.Xresources', '~/.Xdefaults',
+                      '~/.config/regolith3/Xresources', '~/.config/regolith2/Xresources',
+                      '~/.config/regolith/Xresources')
+# seconds after which the database is queried again anyway, catches 'xrdb -merge' and files not listed above
+XRESOURCES_CACHE_TTL = 300
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitFilter(logging.Filter):
+    # passes at most `burst` records of a message template per interval, floods of the same
+    # message are counted and the number of dropped records is added to the next one let through
+    def __init__(self, burst: int = 10, interval: float = 10) -> None:
+        super().__init__()
+        self._burst: int = burst
+        self._interval: float = interval
+        self._lock = threading.Lock()
+        self._windows: MutableMapping[Tuple[str, str], List] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self._interval:
+                dropped = window[1] - self._burst if window is not None and window[1] > self._burst else 0
+                self._windows[key] = [now, 1]
+                if dropped:
+                    record.msg = f'{record.msg} ({dropped} similar messages suppressed)'
+                return True
+            window[1] += 1
+            return window[1] <= self._burst
+
+
+class Dispatcher:
+    # runs observers later, one at a time and in the order they were submitted. schedule(function, *args)
+    # has to call function(*args) later, in FIFO order, e.g. GLib.idle_add
+    def __init__(self, schedule: Callable) -> None:
+        self._schedule: Callable = schedule
+        self._lock = threading.Lock()
+        self._pending: int = 0
+        self._max_pending: int = 0
+        self._dispatched: int = 0
+        self._total_latency: float = 0
+        self._max_latency: float = 0
+
+    def submit(self, observer: Callable, args: tuple, kwargs: Mapping[str, any]) -> None:
+        with self._lock:
+            self._pending += 1
+            self._max_pending = max(self._max_pending, self._pending)
+        self._schedule(self._run, observer, args, kwargs, time.monotonic())
+
+    def _run(self, observer: Callable, args: tuple, kwargs: Mapping[str, any], submitted: float) -> None:
+        try:
+            observer(*args, **kwargs)
+        except Exception:
+            # a failing observer must not stop the ones queued behind it
+            logger.exception('Observer %r failed', observer)
+        finally:
+            # from notify to the observer returning, waiting in the backlog included
+            latency = time.monotonic() - submitted
+            with self._lock:
+                self._pending -= 1
+                self._dispatched += 1
+                self._total_latency += latency
+                self._max_latency = max(self._max_latency, latency)
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def stats(self) -> Mapping[str, any]:
+        with self._lock:
+            return {
+                'pending': self._pending,
+                'max_pending': self._max_pending,
+                'dispatched': self._dispatched,
+                'avg_latency': self._total_latency / self._dispatched if self._dispatched else 0.0,
+                'max_latency': self._max_latency,
+            }
+
 
 class Event:
     def __init__(self) -> None:
-        self._observers: MutableSequence[Callable] = []
+        self._observers: MutableSequence[Tuple[Callable, Optional[Dispatcher]]] = []
 
     def __iadd__(self, observer: Callable) -> 'Event':
-        self._observers.append(observer)
+        self.subscribe(observer)
+        return self
+
+    def __isub__(self, observer: Callable) -> 'Event':
+        self._observers = [(o, d) for o, d in self._observers if o is not observer]
         return self
 
+    def subscribe(self, observer: Callable, dispatcher: Optional[Dispatcher] = None) -> None:
+        # without a dispatcher the observer runs synchronously, inside the notifier's critical section;
+        # copy on write, observers may come and go while another thread notifies
+        self._observers = [*self._observers, (observer, dispatcher)]
+
     def notify(self, *args, **kwargs) -> None:
-        for observer in self._observers:
-            observer(*args, **kwargs)
+        for observer, dispatcher in self._observers:
+            if dispatcher is None:
+                observer(*args, **kwargs)
+            else:
+                dispatcher.submit(observer, args, kwargs)
+
+
+class ResourceLoader:
+    def __init__(self, cache_file: str = XRESOURCES_CACHE, sources: Sequence[str] = XRESOURCES_SOURCES,
+                 ttl: float = XRESOURCES_CACHE_TTL) -> None:
+        self._cache_file: str = cache_file
+        self._sources: Sequence[str] = sources
+        self._ttl: float = ttl
+        self._loaded: bool = False
+        self._database: Optional[Mapping[str, str]] = None
+        self._patterns: Sequence[Tuple[int, Pattern, str]] = ()
+
+    @staticmethod
+    def _mtime(path: Optional[str]) -> Optional[float]:
+        if not path:
+            return None
+        try:
+            return os.stat(os.path.expanduser(path)).st_mtime
+        except OSError:
+            return None
+
+    def _cache_key(self) -> Mapping[str, any]:
+        display = os.getenv('DISPLAY')
+        xauthority = os.getenv('XAUTHORITY')
+        # a new X session gets a new server socket and authority file even on the same display
+        number = re.match(r'[^:]*:(\d+)', display or '')
+        return {'display': display,
+                'server': self._mtime(f'/tmp/.X11-unix/X{number.group(1)}') if number else None,
+                'xauthority': [xauthority, self._mtime(xauthority)],
+                'sources': {source: self._mtime(source) for source in self._sources}}
+
+    def _read_cache(self, key: Mapping[str, any]) -> Optional[Mapping[str, str]]:
+        try:
+            with open(self._cache_file, 'r') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return None
+        age = time.time() - cache.get('written', 0)
+        if cache.get('key') != key or not 0 <= age < self._ttl:
+            return None
+        return cache.get('database')
+
+    def _write_cache(self, key: Mapping[str, any], database: Mapping[str, str]) -> None:
+        tmp_file = self._cache_file + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self._cache_file), exist_ok=True)
+            with open(tmp_file, 'w') as f:
+                json.dump({'key': key, 'written': time.time(), 'database': database}, f)
+            os.replace(tmp_file, self._cache_file)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _query() -> Optional[Mapping[str, str]]:
+        try:
+            output = check_output(('xrdb', '-query'), universal_newlines=True)
+        except (OSError, CalledProcessError):
+            return None
+        database: MutableMapping[str, str] = {}
+        for line in output.splitlines():
+            name, sep, value = line.partition(':')
+            if sep:
+                database[name.strip()] = value.strip()
+        return database
+
+    @staticmethod
+    def _compile(name: str) -> Tuple[int, Pattern]:
+        # '*' binds loosely (any number of components), '?' matches exactly one component,
+        # more literal components make a more specific match
+        regex = ''
+        literals = 0
+        for binding, component in re.findall(r'([.*]*)([^.*]+)', name):
+            regex += r'(?:\.[^.]+)*\.' if '*' in binding else r'\.'
+            if component == '?':
+                regex += r'[^.]+'
+            else:
+                regex += re.escape(component)
+                literals += 1
+        return literals, re.compile(regex + '$')
+
+    def load(self) -> None:
+        self._loaded = True
+        key = self._cache_key()
+        database = self._read_cache(key)
+        if database is None:
+            database = self._query()
+            if database is not None:
+                self._write_cache(key, database)
+        self._database = database
+        if database is not None:
+            patterns = [(*self._compile(name), value) for name, value in database.items()
+                        if '*' in name or '?' in name]
+            self._patterns = sorted(patterns, key=lambda pattern: -pattern[0])
+
+    def get(self, name: str, default: str) -> str:
+        if not self._loaded:
+            self.load()
+        if self._database is None:
+            # no xrdb available, resolve this resource on its own
+            return check_output(('xrescat', name, default), universal_newlines=True)
+        value = self._database.get(name)
+        if value is None:
+            value = next((value for _, pattern, value in self._patterns
+                          if pattern.match('.' + name)), default)
+        return value
+
+
+resource_loader = ResourceLoader()
 
 
 class Resource:
@@ -27,9 +236,8 @@ class Resource:
         if self.env_name:
             env_val = os.getenv(self.env_name)
 
-        # avoid calling xrescat if the environment variable is set
+        # avoid querying X resources if the environment variable is set
         if env_val is None:
-            cmd = ('xrescat', self.xres_name, self.default)
-            return check_output(cmd, universal_newlines=True)
+            return resource_loader.get(self.xres_name, self.default)
         else:
             return env_val
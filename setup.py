@@ -27,13 +27,13 @@ def read_metadata():
 NAME, VERSION, URL = read_metadata()
 DESCRIPTION = 'Notification system that provides a Rofi front-end'
 
-REQUIRED_PYTHON_VERSION = '>=3.6.0'
+REQUIRED_PYTHON_VERSION = '>=3.7.0'
 LICENSE = 'MIT'
 CLASSIFIERS = [
     'License :: OSI Approved :: MIT License',
     'Programming Language :: Python',
     'Programming Language :: Python :: 3',
-    'Programming Language :: Python :: 3.6',
+    'Programming Language :: Python :: 3.7',
     'Programming Language :: Python :: Implementation :: CPython'
 ]
 